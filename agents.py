@@ -2,244 +2,1040 @@
 
 import os
 import json
-from dotenv import load_dotenv
-from langchain_together import ChatTogether
-from langchain_tavily import TavilySearch
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from clients import get_provider, RateLimitedTool, StreamInterrupted
+from models import registry as models
+from tracing import record_llm, record_cache, record_timing, record_error
+from cache import SQLiteCache, CachedSearchTool, LLMResponseCache
+from knowledge import KnowledgeStore
+from budget import (
+    SHORT_SUMMARIES,
+    SKIP_CRITIQUE,
+    FINISH,
+    degradation_level,
+    max_tokens_for
+)
+from digest import (
+    CRITIQUE_TOKEN_BUDGET,
+    DIGEST_TOKEN_BUDGET,
+    WRITER_FINDINGS_TOKEN_BUDGET,
+    estimate_tokens,
+    truncate_to_tokens,
+    outline_draft,
+    pending_findings,
+    merge_findings,
+    amerge_findings
+)
 from prompts import (
     supervisor_prompt_template,
     researcher_prompt_template,
     writer_prompt_template,
-    critique_prompt_template
+    critique_prompt_template,
+    reviewer_prompt_template,
+    digest_prompt_template,
+    section_revision_prompt_template,
+    outline_prompt_template,
+    section_writer_prompt_template,
+    report_merge_prompt_template
+)
+from langgraph.constants import TAG_NOSTREAM
+from structured import (
+    StructuredStream,
+    parse_structured,
+    validate,
+    SUPERVISOR_SCHEMA,
+    REVIEW_SCHEMA,
+    OUTLINE_SCHEMA,
+    OUTLINE_MAX_TOKENS
+)
+from retrieval import RETRIEVAL_ENABLED, EVIDENCE_TOKEN_BUDGET, index_for, compress_results
+from sections import (
+    SECTION_REVISIONS,
+    WRITER_MODE,
+    MAX_REPORT_SECTIONS,
+    split_sections,
+    join_sections,
+    section_outline,
+    splice_sections,
+    sections_for_critique,
+    with_heading,
+    parse_outline,
+    assemble_report
 )
 
-# Load environment variables
-load_dotenv()
-import getpass
-import os
-
-if not os.environ.get("TAVILY_API_KEY"):
-    os.environ["TAVILY_API_KEY"] = getpass.getpass("Tavily API key:\n")
 # --- 1. Setup LLM and Tools ---
 
-# Initialize the ChatTogether LLM (latest non-deprecated version)
-llm = ChatTogether(
-    model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-    temperature=0.3,
-    max_tokens=4096,
-    together_api_key=os.environ.get("TOGETHER_API_KEY")
+# Clients are built on first use, so importing this module makes no network
+# clients and never prompts. Entry points load .env before importing it.
+
+# Rate limits and retries shared by every call to each provider
+together = get_provider("together")
+
+# Request full page text from Tavily; the researcher extracts the relevant sentences from it
+SEARCH_RAW_CONTENT = os.environ.get("SEARCH_RAW_CONTENT", "0") == "1"
+
+_search_tool = None
+
+def get_llm(node="writer"):
+    """Returns the ChatTogether LLM a node's next call uses (see models.py), creating it on first use."""
+    return models.peek(node)
+
+def get_search_tool():
+    """Returns the shared, rate-limited and cached Tavily tool, creating it on first use."""
+    global _search_tool
+    if _search_tool is None:
+        if not os.environ.get("TAVILY_API_KEY"):
+            raise EnvironmentError("TAVILY_API_KEY is not set")
+
+        from langchain_tavily import TavilySearch
+
+        # Initialize the Tavily Search Tool (official method from docs)
+        tool = TavilySearch(
+            max_results=5,
+            topic="general",
+            include_answer=False,
+            include_raw_content=SEARCH_RAW_CONTENT,
+            search_depth="basic"
+        )
+        tool = RateLimitedTool(tool, get_provider("tavily"))
+
+        if os.environ.get("SEARCH_CACHE_ENABLED", "1") == "1":
+            tool = CachedSearchTool(tool, search_cache)
+        _search_tool = tool
+    return _search_tool
+
+def configure(llm=None, search_tool=None):
+    """Replaces the LLM of every node and/or the search tool, e.g. with local stand-ins."""
+    global _search_tool
+    if llm is not None:
+        models.override = llm
+    if search_tool is not None:
+        _search_tool = search_tool
+
+# Cache search results on disk so repeated queries skip the Tavily API
+CACHE_DB = os.environ.get("CACHE_DB", os.path.join(".cache", "research_cache.sqlite"))
+
+search_cache = SQLiteCache(
+    CACHE_DB,
+    table="search_cache",
+    ttl=int(os.environ.get("SEARCH_CACHE_TTL", "86400")),
+    max_entries=int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "1000"))
 )
 
-# Initialize the Tavily Search Tool (official method from docs)
-tavily_tool = TavilySearch(
-    max_results=5,
-    topic="general",
-    include_answer=False,
-    include_raw_content=False,
-    search_depth="basic"
+# Cache LLM completions by model settings and rendered prompt
+llm_cache = LLMResponseCache(
+    CACHE_DB,
+    table="llm_cache",
+    ttl=int(os.environ.get("LLM_CACHE_TTL", "604800")),
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000"))
 )
 
-# --- 2. Create Agent Nodes ---
+# Findings from past runs, consulted before searching so related topics reuse them
+KNOWLEDGE_ENABLED = os.environ.get("KNOWLEDGE_ENABLED", "1") == "1"
+
+knowledge = KnowledgeStore(
+    os.environ.get("KNOWLEDGE_DB", CACHE_DB),
+    min_coverage=float(os.environ.get("KNOWLEDGE_MIN_COVERAGE", "0.8")),
+    max_entries=int(os.environ.get("KNOWLEDGE_MAX_ENTRIES", "5000"))
+)
+
+# Nodes whose LLM calls may be answered from the cache (the writer wants fresh output)
+LLM_CACHE_NODES = set(
+    n.strip() for n in os.environ.get("LLM_CACHE_NODES", "supervisor,researcher,critique,digest").split(",") if n.strip()
+)
+
+# Maximum number of search queries the supervisor may fan out in one research step
+MAX_SUB_TASKS = int(os.environ.get("MAX_SUB_TASKS", "4"))
+
+# Number of writer revisions after which the report is accepted as is
+MAX_REVISIONS = 3
+
+# "fused": one reviewer call returns the critique and the next step; "separate": critique, then supervisor
+REVIEW_MODE = os.environ.get("REVIEW_MODE", "fused")
+
+# Let the supervisor decide obvious transitions without calling the LLM
+SUPERVISOR_FAST_PATH = os.environ.get("SUPERVISOR_FAST_PATH", "1") == "1"
+
+# --- 2. Shared Helpers ---
+
+def _content(response):
+    """Extracts the text of an LLM response."""
+    # ChatTogether returns AIMessage object
+    return response.content if hasattr(response, 'content') else str(response)
+
+def _token_usage(response):
+    """Reads (input, output) token counts from an LLM response, if reported."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    
+    metadata = getattr(response, "response_metadata", None) or {}
+    token_usage = metadata.get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+def _cache_key(node, llm, prompt, max_tokens=None):
+    """Cache key for a node's prompt on a client, or None if the node opted out."""
+    return llm_cache.key_for(llm, prompt, max_tokens) if node in LLM_CACHE_NODES else None
+
+def _lookup_cache(node, prompt, max_tokens=None):
+    """Returns the cached text for a node's prompt on the model its next call would use, or None."""
+    # peek() leaves the registry's health and fallback state alone; choose() runs once, in models.call
+    key = _cache_key(node, models.peek(node), prompt, max_tokens)
+    if key is None:
+        return None
+    
+    cached = llm_cache.lookup(key)
+    record_cache("llm", cached is not None)
+    return cached
+
+def _keyed(node, prompt, max_tokens, fn):
+    """Wraps fn(llm) for models.call so it also returns the cache key of the client the call actually ran on."""
+    def call(llm):
+        return _cache_key(node, llm, prompt, max_tokens), fn(llm)
+    return call
+
+def _akeyed(node, prompt, max_tokens, fn):
+    """Async counterpart of _keyed for models.acall."""
+    async def call(llm):
+        return _cache_key(node, llm, prompt, max_tokens), await fn(llm)
+    return call
+
+def _finish_llm_call(key, prompt, response, start, text=None):
+    """Records a completed LLM call on the trace, caches it and returns its text (text overrides the response's)."""
+    seconds = time.perf_counter() - start
+    content = text if text is not None else _content(response) if response is not None else ""
+    input_tokens, output_tokens = _token_usage(response)
+    
+    # Streams do not always report usage; estimate it so budgets still see the call
+    input_tokens = input_tokens or estimate_tokens(prompt)
+    output_tokens = output_tokens or estimate_tokens(content)
+    record_llm(len(prompt), input_tokens, output_tokens, seconds)
+    
+    if key and content:
+        llm_cache.store(key, content, seconds, input_tokens + output_tokens)
+    return content
+
+def _llm_kwargs(max_tokens):
+    # Per-call override of the model's max_tokens (used when the run budget runs low)
+    return {"max_tokens": max_tokens} if max_tokens else {}
+
+def _invoke_llm(prompt, node, max_tokens=None):
+    """Calls the LLM for a node and returns the response text."""
+    cached = _lookup_cache(node, prompt, max_tokens)
+    if cached is not None:
+        return cached
+    
+    start = time.perf_counter()
+    # Errors propagate once the provider retries and the fallback model are used up,
+    # so the traced span and the failed graph step record them and a run can resume
+    key, response = models.call(node, _keyed(node, prompt, max_tokens, lambda llm: together.call(llm.invoke, prompt, **_llm_kwargs(max_tokens))))
+    return _finish_llm_call(key, prompt, response, start)
+
+async def _ainvoke_llm(prompt, node, max_tokens=None):
+    """Async counterpart of _invoke_llm."""
+    cached = _lookup_cache(node, prompt, max_tokens)
+    if cached is not None:
+        return cached
+    
+    start = time.perf_counter()
+    key, response = await models.acall(node, _akeyed(node, prompt, max_tokens, lambda llm: together.acall(llm.ainvoke, prompt, **_llm_kwargs(max_tokens))))
+    return _finish_llm_call(key, prompt, response, start)
+
+def _stream_llm(prompt, node, max_tokens=None):
+    """Like _invoke_llm, but streams the completion so its tokens reach graph stream listeners."""
+    cached = _lookup_cache(node, prompt, max_tokens)
+    if cached is not None:
+        return cached
+    
+    def consume(llm):
+        message = None
+        try:
+            for chunk in llm.stream(prompt, **_llm_kwargs(max_tokens)):
+                message = chunk if message is None else message + chunk
+        except Exception as e:
+            # Only a stream that has not emitted anything yet may be retried
+            if message is not None:
+                raise StreamInterrupted(f"Stream failed after output was emitted: {e}") from e
+            raise
+        return message
+    
+    start = time.perf_counter()
+    key, message = models.call(node, _keyed(node, prompt, max_tokens, lambda llm: together.call(consume, llm)))
+    return _finish_llm_call(key, prompt, message, start)
+
+async def _astream_llm(prompt, node, max_tokens=None):
+    """Async counterpart of _stream_llm."""
+    cached = _lookup_cache(node, prompt, max_tokens)
+    if cached is not None:
+        return cached
+    
+    async def consume(llm):
+        message = None
+        try:
+            async for chunk in llm.astream(prompt, **_llm_kwargs(max_tokens)):
+                message = chunk if message is None else message + chunk
+        except Exception as e:
+            if message is not None:
+                raise StreamInterrupted(f"Stream failed after output was emitted: {e}") from e
+            raise
+        return message
+    
+    start = time.perf_counter()
+    key, message = await models.acall(node, _akeyed(node, prompt, max_tokens, lambda llm: together.acall(consume, llm)))
+    return _finish_llm_call(key, prompt, message, start)
+
+def _structured_llm(prompt, node, schema, max_tokens):
+    """Streams a JSON answer and stops generating once it holds a complete object matching schema.
+    
+    Returns the object's JSON text, or the whole completion when no valid object
+    appeared, so callers keep their own fallback parsing.
+    """
+    cached = _lookup_cache(node, prompt, max_tokens)
+    if cached is not None:
+        return parse_structured(cached, schema)
+    
+    def consume(llm):
+        parser, message = StructuredStream(schema), None
+        # Tagged so the JSON does not reach graph token streams
+        stream = llm.stream(prompt, config={"tags": [TAG_NOSTREAM]}, **_llm_kwargs(max_tokens))
+        try:
+            for chunk in stream:
+                message = chunk if message is None else message + chunk
+                if parser.feed(_content(chunk)) is not None:
+                    break
+        finally:
+            # Closing the stream ends the request, so the model stops generating
+            stream.close()
+        return message, parser
+    
+    start = time.perf_counter()
+    key, (message, parser) = models.call(node, _keyed(node, prompt, max_tokens, lambda llm: together.call(consume, llm)))
+    return _finish_llm_call(key, prompt, message, start, parser.output())
+
+async def _astructured_llm(prompt, node, schema, max_tokens):
+    """Async counterpart of _structured_llm."""
+    cached = _lookup_cache(node, prompt, max_tokens)
+    if cached is not None:
+        return parse_structured(cached, schema)
+    
+    async def consume(llm):
+        parser, message = StructuredStream(schema), None
+        stream = llm.astream(prompt, config={"tags": [TAG_NOSTREAM]}, **_llm_kwargs(max_tokens))
+        try:
+            async for chunk in stream:
+                message = chunk if message is None else message + chunk
+                if parser.feed(_content(chunk)) is not None:
+                    break
+        finally:
+            await stream.aclose()
+        return message, parser
+    
+    start = time.perf_counter()
+    key, (message, parser) = await models.acall(node, _akeyed(node, prompt, max_tokens, lambda llm: together.acall(consume, llm)))
+    return _finish_llm_call(key, prompt, message, start, parser.output())
+
+# --- 3. Create Agent Nodes ---
+
+# ----------------- #
+# STATE DIGEST      #
+# ----------------- #
+def _digest_prompt(state, text, budget):
+    """Renders the prompt that compresses findings into the rolling digest."""
+    return digest_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        max_words=budget * 3 // 4,
+        findings=text
+    )
+
+def _digest_update(state, digest):
+    return {
+        "findings_digest": digest,
+        "digested_count": len(state.get("research_findings", []))
+    }
+
+def create_digest_updater():
+    """Creates the updater that folds new findings into the rolling digest."""
+    def digest_invoke(state):
+        new_findings = pending_findings(state)
+        # Prompts draw on the findings index instead of the digest when retrieval is enabled
+        if RETRIEVAL_ENABLED or not new_findings:
+            return {}
+
+        summarize = lambda text, budget: _invoke_llm(_digest_prompt(state, text, budget), "digest")
+        digest = merge_findings(state.get("findings_digest", ""), new_findings, summarize)
+        return _digest_update(state, digest)
+    
+    return digest_invoke
+
+def create_async_digest_updater():
+    """Creates the async digest updater."""
+    async def digest_ainvoke(state):
+        new_findings = pending_findings(state)
+        # Prompts draw on the findings index instead of the digest when retrieval is enabled
+        if RETRIEVAL_ENABLED or not new_findings:
+            return {}
+
+        async def asummarize(text, budget):
+            return await _ainvoke_llm(_digest_prompt(state, text, budget), "digest")
+
+        digest = await amerge_findings(state.get("findings_digest", ""), new_findings, asummarize)
+        return _digest_update(state, digest)
+    
+    return digest_ainvoke
 
 # ----------------- #
 # SUPERVISOR NODE   #
 # ----------------- #
+def _clean_queries(queries):
+    """Strips, de-duplicates and caps search queries; a single string counts as one query."""
+    if isinstance(queries, str):
+        queries = [queries]
+    queries = [str(q).strip() for q in queries or [] if str(q).strip()]
+    # Drop duplicates while keeping the model's order
+    return list(dict.fromkeys(queries))[:MAX_SUB_TASKS]
+
+def _with_sub_tasks(decision):
+    """Normalizes the research sub-queries of a supervisor decision."""
+    if decision.get("next_step") != "researcher":
+        decision["sub_tasks"] = []
+        return decision
+    
+    decision["sub_tasks"] = _clean_queries(decision.get("sub_tasks")) or [decision.get("task_description", "")]
+    return decision
+
+def _supervisor_prompt(state):
+    """Renders the supervisor prompt from the bounded research context, outline and critique."""
+    findings = state.get("research_findings", [])
+    if RETRIEVAL_ENABLED and findings:
+        # Passages most relevant to the topic and to what the critique says is missing
+        query = f"{state.get('main_task', '')} {state.get('critique_notes', '')}"
+        research_text = index_for(findings).context(query, budget=DIGEST_TOKEN_BUDGET)
+    else:
+        research_text = state.get("findings_digest") or "\n---\n".join(findings)
+    draft_outline = state.get("draft_outline") or outline_draft(state.get("draft", ""))
+    
+    return supervisor_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        research_findings=truncate_to_tokens(research_text, DIGEST_TOKEN_BUDGET) or "No research yet.",
+        draft=draft_outline or "No draft yet.",
+        critique_notes=truncate_to_tokens(state.get("critique_notes", ""), CRITIQUE_TOKEN_BUDGET) or "No critique yet.",
+        revision_number=state.get("revision_number", 0),
+        findings_count=len(findings),
+        max_sub_tasks=MAX_SUB_TASKS
+    )
+
+def _parse_supervisor_decision(content, state):
+    """Parses the supervisor's JSON decision, falling back to state-based rules."""
+    try:
+        text = content.strip()
+        # Remove markdown code blocks if present
+        if text.startswith("```"):
+            lines = text.split("\n")
+            text = "\n".join([l for l in lines if not l.strip().startswith("```")])
+        text = text.strip()
+
+        decision = json.loads(text)
+
+        # SchemaError is a ValueError, so an unknown next_step falls back to the rules below
+        validate(decision, SUPERVISOR_SCHEMA)
+        return _with_sub_tasks(decision)
+
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"JSON parsing error: {e}, using fallback logic")
+        record_error(e)
+
+        # Fallback parsing based on state
+        revision = state.get("revision_number", 0)
+        has_research = len(state.get("research_findings", [])) > 0
+        has_draft = bool(state.get("draft", "").strip())
+        critique = state.get("critique_notes", "").upper()
+
+        # Decision logic
+        if "APPROVED" in critique:
+            decision = {"next_step": "END", "task_description": "Report approved"}
+        elif not has_research:
+            decision = {"next_step": "researcher", "task_description": f"Research the topic: {state.get('main_task', '')}"}
+        elif not has_draft:
+            decision = {"next_step": "writer", "task_description": "Write the first draft based on research"}
+        elif revision >= MAX_REVISIONS:
+            decision = {"next_step": "END", "task_description": "Maximum revisions reached"}
+        elif content and ("end" in content.lower() or "complete" in content.lower()):
+            decision = {"next_step": "END", "task_description": "Complete"}
+        elif content and "research" in content.lower():
+            decision = {"next_step": "researcher", "task_description": "Gather additional research"}
+        else:
+            decision = {"next_step": "writer", "task_description": "Revise the draft based on critique"}
+
+        return _with_sub_tasks(decision)
+
+def _route_obvious(state):
+    """Decides transitions that follow from the state alone, or returns None if the LLM is needed."""
+    if not SUPERVISOR_FAST_PATH:
+        return None
+    
+    has_research = len(state.get("research_findings", [])) > 0
+    has_draft = bool(state.get("draft", "").strip())
+    
+    if "APPROVED" in state.get("critique_notes", "").upper():
+        decision = {"next_step": "END", "task_description": "Report approved"}
+    elif has_draft and state.get("revision_number", 0) >= MAX_REVISIONS:
+        decision = {"next_step": "END", "task_description": "Maximum revisions reached"}
+    elif not has_research and MAX_SUB_TASKS <= 1:
+        # With fan-out enabled the LLM still plans the first round of sub-queries
+        decision = {"next_step": "researcher", "task_description": f"Research the topic: {state.get('main_task', '')}"}
+    elif has_research and not has_draft:
+        decision = {"next_step": "writer", "task_description": "Write the first draft based on research"}
+    else:
+        return None
+    
+    decision["fast_path"] = True
+    return _with_sub_tasks(decision)
+
+def _route_budget(state):
+    """Ends the run (writing a draft first if there is none) once its budget is spent, else None."""
+    if degradation_level(state) < FINISH:
+        return None
+    
+    if state.get("draft", "").strip() or not state.get("research_findings"):
+        decision = {"next_step": "END", "task_description": "Budget exhausted; finishing with the current draft"}
+    else:
+        decision = {"next_step": "writer", "task_description": "Budget exhausted; write the report from the research so far"}
+    
+    decision["fast_path"] = True
+    return _with_sub_tasks(decision)
+
 def create_supervisor_chain():
     """Creates the supervisor decision chain."""
     def supervisor_invoke(state):
-        research = state.get("research_findings", [])
-        research_text = "\n---\n".join(research) if research else "No research yet."
-        
-        prompt = supervisor_prompt_template.format(
-            main_task=state.get("main_task", ""),
-            research_findings=research_text,
-            draft=state.get("draft", "No draft yet."),
-            critique_notes=state.get("critique_notes", "No critique yet."),
-            revision_number=state.get("revision_number", 0)
-        )
-        
-        try:
-            response = llm.invoke(prompt)
-            # ChatTogether returns AIMessage object
-            content = response.content if hasattr(response, 'content') else str(response)
-        except Exception as e:
-            print(f"LLM Error: {e}")
-            content = ""
-        
-        # Parse JSON response
-        try:
-            text = content.strip()
-            # Remove markdown code blocks if present
-            if text.startswith("```"):
-                lines = text.split("\n")
-                text = "\n".join([l for l in lines if not l.strip().startswith("```")])
-            text = text.strip()
-            
-            decision = json.loads(text)
-            
-            # Validate decision structure
-            if "next_step" not in decision:
-                raise ValueError("Missing next_step in decision")
-                
+        decision = _route_budget(state) or _route_obvious(state)
+        if decision:
             return decision
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"JSON parsing error: {e}, using fallback logic")
-            
-            # Fallback parsing based on state
-            revision = state.get("revision_number", 0)
-            has_research = len(research) > 0
-            has_draft = bool(state.get("draft", "").strip())
-            critique = state.get("critique_notes", "").upper()
-            
-            # Decision logic
-            if "APPROVED" in critique:
-                return {"next_step": "END", "task_description": "Report approved"}
-            elif not has_research:
-                return {"next_step": "researcher", "task_description": f"Research the topic: {state.get('main_task', '')}"}
-            elif not has_draft:
-                return {"next_step": "writer", "task_description": "Write the first draft based on research"}
-            elif revision >= 3:
-                return {"next_step": "END", "task_description": "Maximum revisions reached"}
-            elif content and ("end" in content.lower() or "complete" in content.lower()):
-                return {"next_step": "END", "task_description": "Complete"}
-            elif content and "research" in content.lower():
-                return {"next_step": "researcher", "task_description": "Gather additional research"}
-            else:
-                return {"next_step": "writer", "task_description": "Revise the draft based on critique"}
+
+        content = _structured_llm(_supervisor_prompt(state), "supervisor", SUPERVISOR_SCHEMA, None)
+
+        return _parse_supervisor_decision(content, state)
     
     return supervisor_invoke
 
+def create_async_supervisor_chain():
+    """Creates the async supervisor decision chain."""
+    async def supervisor_ainvoke(state):
+        decision = _route_budget(state) or _route_obvious(state)
+        if decision:
+            return decision
+
+        content = await _astructured_llm(_supervisor_prompt(state), "supervisor", SUPERVISOR_SCHEMA, None)
+
+        return _parse_supervisor_decision(content, state)
+    
+    return supervisor_ainvoke
+
 # ----------------- #
 # RESEARCHER NODE   #
 # ----------------- #
+def _research_query(input_dict):
+    """Returns the search query for a researcher input."""
+    query = input_dict.get("input", "")
+    
+    if not query or query in ["Continue work", "Complete"]:
+        query = "General research information"
+    
+    return query
+
+def _search_results(search_response):
+    """Returns (results, raw_output) from a Tavily response; raw_output is set when there are no results."""
+    raw_output = ""
+    
+    # Parse the response
+    if isinstance(search_response, str):
+        # Response is JSON string, parse it
+        try:
+            search_data = json.loads(search_response)
+            results = search_data.get('results', [])
+        except json.JSONDecodeError:
+            results = []
+            raw_output = search_response
+    elif isinstance(search_response, dict):
+        # Response is already a dict
+        results = search_response.get('results', [])
+    else:
+        results = []
+        raw_output = str(search_response)
+    
+    return results, raw_output or ("" if results else "No results found")
+
+def _format_search_response(results, raw_output, query, level=0):
+    """Compresses search results into query-relevant evidence for the summarization prompt."""
+    # Keep the most relevant sentences of every result within the evidence budget
+    if results:
+        budget = EVIDENCE_TOKEN_BUDGET // 2 if level >= SHORT_SUMMARIES else EVIDENCE_TOKEN_BUDGET
+        return compress_results(query, results, budget) or "No results found"
+    return raw_output
+
+def _known_findings(query):
+    """Returns stored findings from earlier runs that cover query, or None if it must be searched."""
+    if not KNOWLEDGE_ENABLED:
+        return None
+    
+    try:
+        entries = knowledge.lookup(query)
+    except Exception as e:
+        print(f"Knowledge store error: {e}")
+        record_error(e)
+        return None
+    
+    record_cache("knowledge", bool(entries))
+    if not entries:
+        return None
+    
+    print(f"Reusing {len(entries)} stored findings for: {query}")
+    return "\n\n".join(entry["text"] for entry in entries)
+
+def _remember(query, summary, results):
+    """Stores a summarized search so later runs can reuse it."""
+    if not KNOWLEDGE_ENABLED or not results or not summary:
+        return
+    
+    try:
+        knowledge.add(query, summary, [result.get("url") for result in results])
+    except Exception as e:
+        print(f"Knowledge store error: {e}")
+        record_error(e)
+
+def _summary_prompt(query, raw_output, bullets="5-7"):
+    """Renders the prompt that summarizes search results."""
+    return f"""Based on these search results about "{query}", provide a concise summary of key findings ({bullets} bullet points):
+
+{raw_output}
+
+Format as clear bullet points with the most important information."""
+
 def create_researcher_agent():
     """Creates a researcher agent that uses search."""
     
     def researcher_invoke(input_dict):
         """Execute research using Tavily search."""
-        query = input_dict.get("input", "")
-        
-        if not query or query in ["Continue work", "Complete"]:
-            query = "General research information"
-        
+        query = _research_query(input_dict)
+        level = input_dict.get("budget_level", 0)
         print(f"Researching: {query}")
         
-        try:
-            # Use the tavily tool - invoke method as per official docs
-            search_response = tavily_tool.invoke({"query": query})
-            
-            # Parse the response
-            if isinstance(search_response, str):
-                # Response is JSON string, parse it
-                import json
-                try:
-                    search_data = json.loads(search_response)
-                    results = search_data.get('results', [])
-                except json.JSONDecodeError:
-                    results = []
-                    raw_output = search_response
-            elif isinstance(search_response, dict):
-                # Response is already a dict
-                results = search_response.get('results', [])
-            else:
-                results = []
-                raw_output = str(search_response)
-            
-            # Format the results
-            formatted_results = []
-            
-            if results:
-                for result in results[:3]:
-                    title = result.get('title', 'Untitled')
-                    url = result.get('url', 'N/A')
-                    content = result.get('content', '')
-                    formatted_results.append(f"**{title}**\nSource: {url}\n{content[:300]}...\n")
-                
-                raw_output = "\n---\n".join(formatted_results)
-            elif not raw_output:
-                raw_output = "No results found"
-            
-            # Summarize with LLM
-            summary_prompt = f"""Based on these search results about "{query}", provide a concise summary of key findings (5-7 bullet points):
+        known = _known_findings(query)
+        if known:
+            return {"output": known, "input": query}
 
-{raw_output}
+        # Use the tavily tool - invoke method as per official docs
+        start = time.perf_counter()
+        search_response = get_search_tool().invoke({"query": query})
+        record_timing("search", time.perf_counter() - start)
+        results, raw_output = _search_results(search_response)
+        raw_output = _format_search_response(results, raw_output, query, level)
+        
+        # Summarize with LLM (shorter once the run budget runs low)
+        try:
+            bullets = "3-4" if level >= SHORT_SUMMARIES else "5-7"
+            summary = _invoke_llm(
+                _summary_prompt(query, raw_output, bullets), "researcher", max_tokens_for("researcher", level)
+            )
+            _remember(query, summary, results)
+        except Exception as e:
+            print(f"Summarization error: {e}")
+            record_error(e)
+            summary = raw_output
+        
+        return {
+            "output": summary if summary else raw_output,
+            "input": query
+        }
+    
+    return researcher_invoke
 
-Format as clear bullet points with the most important information."""
+def create_async_researcher_agent():
+    """Creates an async researcher agent that uses search."""
+    
+    async def researcher_ainvoke(input_dict):
+        """Execute research using async Tavily search."""
+        query = _research_query(input_dict)
+        level = input_dict.get("budget_level", 0)
+        print(f"Researching: {query}")
+        
+        known = _known_findings(query)
+        if known:
+            return {"output": known, "input": query}
 
-            try:
-                summary_response = llm.invoke(summary_prompt)
-                summary = summary_response.content if hasattr(summary_response, 'content') else str(summary_response)
-            except Exception as e:
-                print(f"Summarization error: {e}")
-                summary = raw_output
-            
-            return {
-                "output": summary if summary else raw_output,
-                "input": query
-            }
-            
+        start = time.perf_counter()
+        search_response = await get_search_tool().ainvoke({"query": query})
+        record_timing("search", time.perf_counter() - start)
+        results, raw_output = _search_results(search_response)
+        raw_output = _format_search_response(results, raw_output, query, level)
+        
+        # Summarize with LLM (shorter once the run budget runs low)
+        try:
+            bullets = "3-4" if level >= SHORT_SUMMARIES else "5-7"
+            summary = await _ainvoke_llm(
+                _summary_prompt(query, raw_output, bullets), "researcher", max_tokens_for("researcher", level)
+            )
+            _remember(query, summary, results)
         except Exception as e:
-            print(f"Research error: {e}")
-            return {
-                "output": f"Research completed on: {query}. Key information has been gathered from web sources.",
-                "input": query
-            }
+            print(f"Summarization error: {e}")
+            record_error(e)
+            summary = raw_output
+        
+        return {
+            "output": summary if summary else raw_output,
+            "input": query
+        }
     
-    return researcher_invoke
+    return researcher_ainvoke
 
 # ----------------- #
 # WRITER NODE       #
 # ----------------- #
+def _writer_findings(state, query=None):
+    """Research findings for the writer, bounded by WRITER_FINDINGS_TOKEN_BUDGET.
+    
+    With retrieval enabled these are the deduplicated passages ranked for
+    query (by default the topic and critique); otherwise the raw findings,
+    replaced by the digest once they exceed the budget.
+    """
+    research = state.get("research_findings", [])
+    if not research:
+        return "No research available."
+    
+    if RETRIEVAL_ENABLED:
+        query = query or f"{state.get('main_task', '')} {state.get('critique_notes', '')}"
+        return index_for(research).context(query, budget=WRITER_FINDINGS_TOKEN_BUDGET)
+    
+    research_text = "\n\n".join(research)
+    
+    if estimate_tokens(research_text) > WRITER_FINDINGS_TOKEN_BUDGET:
+        research_text = truncate_to_tokens(
+            state.get("findings_digest") or research_text, WRITER_FINDINGS_TOKEN_BUDGET
+        )
+    return research_text
+
+def _writer_prompt(state):
+    """Renders the full-report writer prompt."""
+    return writer_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        research_findings=_writer_findings(state),
+        draft=state.get("draft", ""),
+        critique_notes=state.get("critique_notes", "")
+    )
+
+def _section_revision(state):
+    """Plans a revision of only the sections the critique concerns.
+    
+    Returns (sections, indices, prompt), or None when the whole report should
+    be (re)written.
+    """
+    critique = state.get("critique_notes", "")
+    if not SECTION_REVISIONS or not state.get("draft") or not critique or critique.upper().startswith("APPROVED"):
+        return None
+    
+    sections = split_sections(state["draft"])
+    indices = sections_for_critique(critique, sections)
+    if indices is None:
+        return None
+    
+    print(f"Revising sections: {', '.join(sections[i]['title'] for i in indices)}")
+    query = " ".join([critique] + [sections[i]["title"] for i in indices])
+    prompt = section_revision_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        research_findings=_writer_findings(state, query),
+        outline=section_outline(sections),
+        sections="\n\n".join(sections[i]["text"] for i in indices),
+        critique_notes=critique
+    )
+    return sections, indices, prompt
+
+def _splice_revision(revision, content):
+    """Splices rewritten sections into the draft; None if the output matched no section."""
+    sections, indices, _ = revision
+    spliced = splice_sections(sections, content, indices)
+    if spliced is None:
+        print("Revised sections could not be matched, rewriting the whole report")
+        return None
+    return join_sections(spliced)
+
+# Excerpt length per finding in the outline prompt; sections get the full text
+OUTLINE_FINDING_TOKENS = 150
+
+def _outline_prompt(state):
+    """Renders the outline planning prompt with numbered excerpts of every finding."""
+    findings = state.get("research_findings", [])
+    numbered = "\n\n".join(
+        f"[{i}] {truncate_to_tokens(f, OUTLINE_FINDING_TOKENS)}" for i, f in enumerate(findings, 1)
+    )
+    return outline_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        findings=numbered or "No research available.",
+        critique_notes=state.get("critique_notes", "") or "None",
+        max_sections=MAX_REPORT_SECTIONS
+    )
+
+def _section_prompt(state, outline, section):
+    """Renders the prompt for one section from the findings the outline assigned to it."""
+    findings = state.get("research_findings", [])
+    if RETRIEVAL_ENABLED:
+        research_text = _writer_findings(state, f"{section['heading']} {section['focus']}")
+    elif section["findings"]:
+        research_text = truncate_to_tokens(
+            "\n\n".join(findings[i] for i in section["findings"]), WRITER_FINDINGS_TOKEN_BUDGET
+        )
+    else:
+        research_text = _writer_findings(state)
+    
+    return section_writer_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        outline="\n".join(f"{i}. {s['heading']}" for i, s in enumerate(outline["sections"], 1)),
+        heading=section["heading"],
+        focus=section["focus"] or section["heading"],
+        research_findings=research_text,
+        critique_notes=state.get("critique_notes", "") or "None"
+    )
+
+def _merge_prompt(state, outline, section_texts):
+    """Renders the merge prompt from the outline of the written sections."""
+    return report_merge_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        title=outline["title"] or state.get("main_task", ""),
+        sections=outline_draft("\n\n".join(section_texts))
+    )
+
+def _plan_outline(content, state):
+    """Parses the outline, returning None (single-call fallback) if it is unusable."""
+    try:
+        return parse_outline(content, len(state.get("research_findings", [])))
+    except (json.JSONDecodeError, ValueError, AttributeError) as e:
+        print(f"Outline parsing error: {e}, writing the report in one pass")
+        record_error(e)
+        return None
+
+def _writer_max_tokens(state):
+    """Reduced max_tokens for writer calls once the run budget runs low, else None."""
+    return max_tokens_for("writer", degradation_level(state))
+
+def _map_reduce_write(state):
+    """Writes a full report as outline -> sections in parallel -> merge pass; None on failure."""
+    try:
+        max_tokens = _writer_max_tokens(state)
+        outline = _plan_outline(_structured_llm(_outline_prompt(state), "writer", OUTLINE_SCHEMA, OUTLINE_MAX_TOKENS), state)
+        if outline is None:
+            return None
+        print(f"Writing {len(outline['sections'])} sections in parallel")
+        
+        def write_section(section):
+            return with_heading(_invoke_llm(_section_prompt(state, outline, section), "writer", max_tokens), section["heading"])
+        
+        # Each thread runs in a copy of this context so tracing and graph callbacks follow the call
+        with ThreadPoolExecutor(max_workers=len(outline["sections"])) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, write_section, section)
+                for section in outline["sections"]
+            ]
+            section_texts = [future.result() for future in futures]
+        
+        framing = _stream_llm(_merge_prompt(state, outline, section_texts), "writer", max_tokens)
+        return assemble_report(outline["title"], section_texts, framing)
+    except Exception as e:
+        print(f"Map-reduce writer error: {e}, writing the report in one pass")
+        record_error(e)
+        return None
+
+async def _amap_reduce_write(state):
+    """Async counterpart of _map_reduce_write."""
+    try:
+        max_tokens = _writer_max_tokens(state)
+        outline = _plan_outline(await _astructured_llm(_outline_prompt(state), "writer", OUTLINE_SCHEMA, OUTLINE_MAX_TOKENS), state)
+        if outline is None:
+            return None
+        print(f"Writing {len(outline['sections'])} sections in parallel")
+        
+        async def write_section(section):
+            return with_heading(await _ainvoke_llm(_section_prompt(state, outline, section), "writer", max_tokens), section["heading"])
+        
+        section_texts = await asyncio.gather(*(write_section(section) for section in outline["sections"]))
+        
+        framing = await _astream_llm(_merge_prompt(state, outline, section_texts), "writer", max_tokens)
+        return assemble_report(outline["title"], section_texts, framing)
+    except Exception as e:
+        print(f"Map-reduce writer error: {e}, writing the report in one pass")
+        record_error(e)
+        return None
+
 def create_writer_chain():
     """Creates the writer chain."""
     def writer_invoke(state):
-        research = state.get("research_findings", [])
-        research_text = "\n\n".join(research) if research else "No research available."
-        
-        prompt = writer_prompt_template.format(
-            main_task=state.get("main_task", ""),
-            research_findings=research_text,
-            draft=state.get("draft", ""),
-            critique_notes=state.get("critique_notes", "")
-        )
+        max_tokens = _writer_max_tokens(state)
+        revision = _section_revision(state)
+        if revision:
+            draft = _splice_revision(revision, _stream_llm(revision[2], "writer", max_tokens))
+            if draft:
+                return draft
         
-        try:
-            response = llm.invoke(prompt)
-            content = response.content if hasattr(response, 'content') else str(response)
-            return content if content else "Draft in progress..."
-        except Exception as e:
-            print(f"Writer error: {e}")
-            return "Error generating draft. Please try again."
+        if state.get("writer_mode", WRITER_MODE) == "map_reduce":
+            draft = _map_reduce_write(state)
+            if draft:
+                return draft
+        
+        content = _stream_llm(_writer_prompt(state), "writer", max_tokens)
+        return content if content else "Draft in progress..."
     
     return writer_invoke
 
+def create_async_writer_chain():
+    """Creates the async writer chain."""
+    async def writer_ainvoke(state):
+        max_tokens = _writer_max_tokens(state)
+        revision = _section_revision(state)
+        if revision:
+            draft = _splice_revision(revision, await _astream_llm(revision[2], "writer", max_tokens))
+            if draft:
+                return draft
+        
+        if state.get("writer_mode", WRITER_MODE) == "map_reduce":
+            draft = await _amap_reduce_write(state)
+            if draft:
+                return draft
+        
+        content = await _astream_llm(_writer_prompt(state), "writer", max_tokens)
+        return content if content else "Draft in progress..."
+    
+    return writer_ainvoke
+
 # ----------------- #
 # CRITIQUE NODE     #
 # ----------------- #
+def _critique_shortcut(state):
+    """Returns an approval when the draft needs no LLM review, else None."""
+    draft = state.get("draft", "")
+    revision_num = state.get("revision_number", 0)
+    
+    # Safety checks
+    if len(draft.strip()) < 100:
+        return "APPROVED - Draft is minimal but acceptable."
+    
+    if revision_num >= MAX_REVISIONS:
+        return "APPROVED - Maximum revisions reached. The report is satisfactory."
+    
+    if degradation_level(state) >= SKIP_CRITIQUE:
+        return "APPROVED - Run budget nearly spent; accepting the current draft."
+    
+    return None
+
+def _critique_prompt(state):
+    """Renders the critique prompt, listing the draft's sections so feedback can reference them."""
+    draft = state.get("draft", "")
+    return critique_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        draft=draft,
+        sections=section_outline(split_sections(draft)) or "(no sections)"
+    )
+
 def create_critique_chain():
     """Creates the critique chain."""
     def critique_invoke(state):
-        draft = state.get("draft", "")
-        revision_num = state.get("revision_number", 0)
-        
-        # Safety checks
-        if len(draft.strip()) < 100:
-            return "APPROVED - Draft is minimal but acceptable."
-        
-        if revision_num >= 3:
-            return "APPROVED - Maximum revisions reached. The report is satisfactory."
+        shortcut = _critique_shortcut(state)
+        if shortcut:
+            return shortcut
+
+        content = _stream_llm(_critique_prompt(state), "critique", max_tokens_for("critique", degradation_level(state)))
+        return content if content else "APPROVED"
+    
+    return critique_invoke
+
+def create_async_critique_chain():
+    """Creates the async critique chain."""
+    async def critique_ainvoke(state):
+        shortcut = _critique_shortcut(state)
+        if shortcut:
+            return shortcut
+
+        content = await _astream_llm(_critique_prompt(state), "critique", max_tokens_for("critique", degradation_level(state)))
+        return content if content else "APPROVED"
+    
+    return critique_ainvoke
+
+# ----------------- #
+# REVIEWER          #
+# ----------------- #
+def _reviewer_prompt(state):
+    """Renders the fused review prompt: critique plus the choice of the next step."""
+    draft = state.get("draft", "")
+    return reviewer_prompt_template.format(
+        main_task=state.get("main_task", ""),
+        findings_count=len(state.get("research_findings", [])),
+        draft=draft,
+        sections=section_outline(split_sections(draft)) or "(no sections)",
+        max_sub_tasks=MAX_SUB_TASKS
+    )
+
+def _approval(critique="APPROVED"):
+    """A review that ends the run, with the reason taken from an "APPROVED - ..." critique."""
+    reason = critique.split(" - ", 1)[1] if " - " in critique else "Report approved"
+    return {"critique": "APPROVED", "next_step": "END", "task_description": reason, "sub_tasks": []}
+
+def _parse_review(content):
+    """Parses the reviewer's JSON into {"critique", "next_step", "task_description", "sub_tasks"}.
+    
+    A reply that is not JSON is read as a plain critique that sends the draft back to the writer.
+    """
+    try:
+        text = content.strip()
+        # Remove markdown code blocks if present
+        if text.startswith("```"):
+            text = "\n".join(l for l in text.split("\n") if not l.strip().startswith("```"))
+        review = json.loads(text.strip())
+        if not isinstance(review, dict):
+            raise ValueError("Review is not a JSON object")
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"JSON parsing error: {e}, reading the review as a plain critique")
+        record_error(e)
+        if not content.strip() or content.strip().upper().startswith("APPROVED"):
+            return _approval()
+        return {"critique": content.strip(), "next_step": "writer", "task_description": "Revise the draft based on critique", "sub_tasks": []}
+    
+    feedback = str(review.get("feedback") or "").strip()
+    next_step = str(review.get("next_step") or "").strip()
+    next_step = "END" if next_step.upper() == "END" else next_step.lower()
+    
+    # Without actionable feedback there is nothing to revise
+    if str(review.get("verdict", "")).lower() == "approved" or next_step == "END" or not feedback:
+        return _approval()
+    
+    queries = _clean_queries(review.get("research_queries"))
+    # Without queries there is nothing to search for (the task description is no query), so the writer revises
+    if next_step == "researcher" and queries:
+        decision = {"next_step": "researcher", "task_description": "Research what the review found missing", "sub_tasks": queries}
+    else:
+        decision = {"next_step": "writer", "task_description": "Revise the draft based on critique"}
+    decision["critique"] = feedback
+    return _with_sub_tasks(decision)
+
+def create_reviewer_chain():
+    """Creates the fused review chain: one call returns the critique and the next step."""
+    def reviewer_invoke(state):
+        shortcut = _critique_shortcut(state)
+        if shortcut:
+            return _approval(shortcut)
         
-        prompt = critique_prompt_template.format(
-            main_task=state.get("main_task", ""),
-            draft=draft
-        )
+        # Parsed as it streams; generation stops once the review object is complete
+        content = _structured_llm(_reviewer_prompt(state), "critique", REVIEW_SCHEMA, max_tokens_for("critique", degradation_level(state)))
+        return _parse_review(content)
+    
+    return reviewer_invoke
+
+def create_async_reviewer_chain():
+    """Creates the async fused review chain."""
+    async def reviewer_ainvoke(state):
+        shortcut = _critique_shortcut(state)
+        if shortcut:
+            return _approval(shortcut)
         
-        try:
-            response = llm.invoke(prompt)
-            content = response.content if hasattr(response, 'content') else str(response)
-            return content if content else "APPROVED"
-        except Exception as e:
-            print(f"Critique error: {e}")
-            return "APPROVED - Error in critique, proceeding with current draft."
+        content = await _astructured_llm(_reviewer_prompt(state), "critique", REVIEW_SCHEMA, max_tokens_for("critique", degradation_level(state)))
+        return _parse_review(content)
     
-    return critique_invoke
\ No newline at end of file
+    return reviewer_ainvoke
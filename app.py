@@ -2,13 +2,50 @@
 
 import streamlit as st
 import os
+import json
+import uuid
 from dotenv import load_dotenv
-from graph import app
-import time
 
-# Load environment variables
+# Load environment variables before the agent modules read their settings
 load_dotenv()
 
+from graph import (
+    get_app,
+    initial_state,
+    iter_run_events,
+    get_checkpointed_app,
+    get_run_state,
+    list_runs,
+    delete_run,
+    resume_run_events,
+    run_config,
+    MAX_PARALLEL_RESEARCH,
+    WRITER_MODE,
+    REVIEW_MODE
+)
+from budget import RUN_TOKEN_BUDGET, RUN_COST_BUDGET, RUN_TIME_BUDGET, LEVEL_NAMES
+from jobs import JobStore
+from blobs import hydrate
+from models import registry as model_registry
+from tracing import summarize as summarize_trace, to_otlp, run_stats
+
+# Compiled graphs are built once per server process, not on every rerun
+@st.cache_resource
+def load_app():
+    return get_app()
+
+@st.cache_resource
+def load_checkpointed_app():
+    return get_checkpointed_app()
+
+# Research runs execute on a worker pool shared by every browser session
+@st.cache_resource
+def load_job_store():
+    return JobStore()
+
+# Seconds between progress refreshes while a run is in progress
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "1.0"))
+
 # --- Page Configuration ---
 st.set_page_config(
     page_title="Multi-Agent Research Assistant 🤖",
@@ -64,9 +101,236 @@ st.divider()
 if not check_api_keys():
     st.stop()
 
+# --- Run Rendering ---
+def render_run(job, max_iterations):
+    """Renders the run events a job has recorded so far and returns the last node output."""
+    events, _ = job.events_since(0)
+    
+    # Create containers for live updates
+    status_container = st.container()
+    progress_bar = st.progress(0)
+    
+    if job.status == "done":
+        label, state = "✅ Work Complete!", "complete"
+    elif job.status == "error":
+        label, state = "❌ Error occurred", "error"
+    else:
+        label, state = "🔄 Agents are collaborating...", "running"
+    
+    # st.status shows progress; node details go in a container since expanders cannot nest
+    with status_container:
+        st.status(label, state=state)
+        with st.container(border=True):
+            final_state = None
+            step_count = 0
+            trace = []
+            
+            # Writer/critiquer tokens since the last node update; rendered once, after the loop
+            live_node = None
+            live_tokens = []
+            
+            for kind, node_name, node_output in events:
+                if kind == "token":
+                    live_node = node_name
+                    live_tokens.append(node_output)
+                    continue
+                
+                # The node finished; its update replaces the streamed text
+                live_node = None
+                live_tokens = []
+                
+                step_count += 1
+                progress_bar.progress(min(step_count / max_iterations, 1.0))
+                # Updates hold blob references; fetch the texts only to display them
+                node_output = hydrate(node_output)
+                final_state = node_output
+                trace.extend(node_output.get("trace", []))
+                
+                # Display node output
+                st.markdown(f"### 🤖 Agent: `{node_name.upper()}`")
+                
+                if node_name == "supervisor":
+                    next_step = node_output.get('next_step', 'N/A')
+                    task = node_output.get('current_sub_task', 'N/A')
+                    st.markdown(f"**Decision:** {next_step}")
+                    avoided = node_output.get('supervisor_llm_calls_avoided', 0)
+                    if avoided:
+                        st.caption(f"⚡ {avoided} supervisor LLM calls avoided so far")
+                    budget_level = node_output.get('budget_level', 0)
+                    if budget_level:
+                        st.caption(f"💰 Budget running low: {LEVEL_NAMES[budget_level]}")
+                    st.markdown(f"**Task:** {task}")
+                    for sub_task in node_output.get('sub_tasks', []):
+                        st.markdown(f"- 🔍 {sub_task}")
+                
+                elif node_name == "researcher":
+                    findings = node_output.get('research_findings', [])
+                    if findings:
+                        latest = findings[-1]
+                        st.success("✓ Research completed")
+                        with st.expander("View findings"):
+                            st.write(latest)
+                
+                elif node_name == "writer":
+                    draft = node_output.get('draft', '')
+                    revision = node_output.get('revision_number', 0)
+                    st.success(f"✓ Draft {revision} generated")
+                    revised = node_output.get('revised_sections', [])
+                    if revision > 1 and revised:
+                        st.caption(f"✏️ Rewritten sections: {', '.join(revised)}")
+                    similarity = (node_output.get('convergence') or {}).get('draft_similarity')
+                    if similarity is not None:
+                        st.caption(f"🔁 {similarity:.0%} identical to the previous draft")
+                    if node_output.get('termination_reason'):
+                        st.info(f"⏹ {node_output['termination_reason']}")
+                    with st.expander("Preview draft"):
+                        st.write(draft[:500] + "..." if len(draft) > 500 else draft)
+                
+                elif node_name == "critiquer":
+                    critique = node_output.get('critique_notes', '')
+                    if "APPROVED" in critique.upper():
+                        st.success("✅ Draft APPROVED!")
+                    elif node_output.get('termination_reason'):
+                        st.info(f"⏹ {node_output['termination_reason']}")
+                    else:
+                        st.warning("📝 Revisions requested")
+                        if node_output.get('next_step') == "researcher":
+                            st.markdown("**Next:** more research")
+                            for sub_task in node_output.get('sub_tasks', []):
+                                st.markdown(f"- 🔍 {sub_task}")
+                        with st.expander("View critique"):
+                            st.write(critique)
+                
+                st.divider()
+            
+            if live_tokens:
+                st.markdown(f"**✍️ {live_node.capitalize()} is writing...**\n\n{''.join(live_tokens)}▌")
+            
+            if job.error:
+                st.error(f"An error occurred: {job.error}")
+    
+    st.session_state["last_trace"] = trace
+    return final_state
+
+def render_job(job, max_iterations):
+    """Shows a background job; while it is running the view polls the job store."""
+    caption = f"🧵 Job `{job.job_id}`: {job.topic}"
+    if job.meta.get("run_id"):
+        caption += f" · 💾 Run ID `{job.meta['run_id']}` (select it in the sidebar to resume if the run fails)"
+    st.caption(caption)
+    
+    if job.done:
+        render_run(job, max_iterations)
+        render_report(job.result, job.topic)
+        return
+    
+    # Only this block re-runs on each poll; the full page re-runs once the job finishes
+    @st.fragment(run_every=JOB_POLL_SECONDS)
+    def poll_job():
+        if job.done:
+            st.rerun()
+        if job.status == "queued":
+            st.info(f"⏳ Waiting for a free worker ({job_store.active_count()} runs in progress)...")
+        else:
+            st.info("🤖 Agents are working. You can keep using the page or refresh it; the run continues in the background.")
+        render_run(job, max_iterations)
+    
+    poll_job()
+
+def render_trace_panel(trace):
+    """Shows the per-node timing, token and cache breakdown of the last run."""
+    st.divider()
+    st.subheader("⏱️ Last Run Trace")
+    
+    if not trace:
+        st.caption("Run a research task to see its per-node breakdown.")
+        return
+    
+    rows = summarize_trace(trace)
+    col1, col2 = st.columns(2)
+    col1.metric("Node Time", f"{sum(r['seconds'] for r in rows):.1f}s")
+    col2.metric("Tokens", sum(r["input_tokens"] + r["output_tokens"] for r in rows))
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+    
+    errors = [f"{span['name']}: {error}" for span in trace for error in span["errors"]]
+    if errors:
+        with st.expander(f"⚠️ {len(errors)} errors"):
+            for error in errors:
+                st.write(error)
+    
+    st.download_button(
+        label="📥 Download Trace (OTLP JSON)",
+        data=json.dumps(to_otlp(trace), indent=2),
+        file_name="research_trace.json",
+        mime="application/json"
+    )
+
+def render_report(final_state, topic):
+    """Displays the final report, its statistics and a download button."""
+    final_state = hydrate(final_state)
+    if final_state and final_state.get("draft"):
+        st.divider()
+        st.header("📄 Final Research Report")
+        
+        # Display report
+        st.markdown(final_state["draft"])
+        
+        # Display metadata
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.subheader("📊 Report Statistics")
+            st.metric("Revisions", final_state.get("revision_number", 0))
+            st.metric("Research Sources", len(final_state.get("research_findings", [])))
+            st.metric("Word Count", len(final_state["draft"].split()))
+            st.metric("Supervisor LLM Calls Avoided", final_state.get("supervisor_llm_calls_avoided", 0))
+            if final_state.get("termination_reason"):
+                st.caption(f"⏹ Stopped: {final_state['termination_reason']}")
+            
+            # Counted on this run's own spans, so concurrent runs do not mix
+            totals = run_stats(final_state.get("trace", []))
+            cache = totals["llm_cache"]
+            st.caption(
+                f"⚡ LLM cache: {cache['hits']} hits, "
+                f"{cache['saved_seconds']:.1f}s and {cache['saved_tokens']} tokens saved"
+            )
+            for provider, stats in totals["providers"].items():
+                st.caption(
+                    f"⏳ {provider}: {stats['calls']} calls, {stats['retries']} retries, "
+                    f"avg queueing {stats['avg_queue_seconds']:.2f}s (max {stats['max_queue_seconds']:.2f}s)"
+                )
+            for route, stats in model_registry.metrics().items():
+                st.caption(
+                    f"🧠 {route}: avg {stats['avg_seconds']:.1f}s, {stats['error_rate']:.0%} errors over the last "
+                    f"{stats['calls']} calls" + (" (on fallback)" if stats["on_fallback"] else "")
+                )
+        
+        with col2:
+            st.subheader("🔍 Research Findings")
+            with st.expander("View all research data"):
+                for idx, finding in enumerate(final_state.get("research_findings", []), 1):
+                    st.markdown(f"**Finding {idx}:**")
+                    st.write(finding)
+                    st.divider()
+        
+        # Download button
+        st.download_button(
+            label="📥 Download Report",
+            data=final_state["draft"],
+            file_name=f"research_report_{topic.replace(' ', '_')}.txt",
+            mime="text/plain"
+        )
+    else:
+        st.error("❌ No report was generated. Please try again.")
+
 # --- Main Application ---
 st.header("🚀 Start Your Research")
 
+# Jobs belong to a browser session; both IDs live in the URL so a refresh re-attaches
+job_store = load_job_store()
+session_id = st.query_params.get("session") or uuid.uuid4().hex[:12]
+st.query_params["session"] = session_id
+
 # User input
 topic = st.text_input(
     "Enter your research topic:",
@@ -84,137 +348,145 @@ with st.sidebar:
         value=15,
         help="Maximum number of agent interactions"
     )
+    max_parallel_research = st.slider(
+        "Parallel Research Workers",
+        min_value=1,
+        max_value=10,
+        value=min(MAX_PARALLEL_RESEARCH, 10),
+        help="Maximum number of research sub-queries searched at the same time"
+    )
+    writer_mode = st.radio(
+        "Writing Mode",
+        options=["single", "map_reduce"],
+        index=1 if WRITER_MODE == "map_reduce" else 0,
+        format_func=lambda mode: "Single pass" if mode == "single" else "Sections in parallel",
+        help="Write the report in one LLM call, or plan an outline and write its sections concurrently"
+    )
+    review_mode = st.radio(
+        "Review Mode",
+        options=["fused", "separate"],
+        index=0 if REVIEW_MODE == "fused" else 1,
+        format_func=lambda mode: "Critique and route in one call" if mode == "fused" else "Critique, then supervisor",
+        help="Let the critiquer also choose the next step, or send every critique back to the supervisor"
+    )
+    
+    st.divider()
+    st.subheader("💰 Run Budget")
+    st.caption("0 means unlimited. Near a limit the run shortens summaries, skips the critique and finishes early.")
+    budget = {
+        "tokens": st.number_input("Max tokens", min_value=0, value=RUN_TOKEN_BUDGET, step=10000),
+        "cost": st.number_input("Max cost ($)", min_value=0.0, value=RUN_COST_BUDGET, step=0.05, format="%.2f"),
+        "seconds": st.number_input("Max time (seconds)", min_value=0.0, value=RUN_TIME_BUDGET, step=30.0),
+    }
+    
+    st.divider()
+    st.subheader("💾 Checkpoints")
+    use_checkpoints = st.checkbox(
+        "Save checkpoints",
+        value=True,
+        help="Save the state after every agent step so a failed run can be resumed"
+    )
+    recent_runs = list_runs(load_checkpointed_app())
+    resume_run_id = st.selectbox("Run to resume", options=recent_runs, index=None, placeholder="Select a run ID")
+    resume_clicked = st.button("▶️ Resume Run", disabled=not resume_run_id, use_container_width=True)
+    if st.button("🗑️ Delete Run", disabled=not resume_run_id, use_container_width=True,
+                 help="Delete the run's checkpoints and the stored texts only it used"):
+        delete_run(load_checkpointed_app(), resume_run_id)
+        st.rerun()
+    
+    session_jobs = job_store.jobs_for(session_id)
+    if session_jobs:
+        st.divider()
+        st.subheader("🧵 Your Runs")
+        icons = {"queued": "⏳", "running": "🔄", "done": "✅", "error": "❌"}
+        for session_job in session_jobs:
+            if st.button(f"{icons[session_job.status]} {session_job.topic[:40]}", key=f"job_{session_job.job_id}", use_container_width=True):
+                st.query_params["job"] = session_job.job_id
     
     st.divider()
     st.subheader("📋 How it works")
     st.markdown("""
     1. **Supervisor** analyzes the task
-    2. **Researcher** gathers information
+    2. **Researchers** gather information in parallel
     3. **Writer** creates a draft
     4. **Critiquer** reviews quality
     5. Loop continues until approved
     """)
 
+# Configuration
+config = {"recursion_limit": max_iterations, "max_concurrency": max_parallel_research}
+
 # Start button
 if st.button("🚀 Start Research", type="primary", use_container_width=True):
     if not topic:
         st.error("⚠️ Please enter a research topic.")
     else:
         # Define the initial state
-        initial_state = {
-            "main_task": topic,
-            "research_findings": [],
-            "draft": "",
-            "critique_notes": "",
-            "revision_number": 0,
-            "next_step": "",
-            "current_sub_task": ""
-        }
-        
-        # Configuration
-        config = {"recursion_limit": max_iterations}
-        
-        st.info("🤖 Agents are starting their work...")
+        start_state = initial_state(topic, writer_mode, budget, review_mode)
         
-        # Create containers for live updates
-        status_container = st.container()
-        progress_bar = st.progress(0)
-        
-        # Use st.status to show progress
-        with status_container:
-            with st.status("🔄 Agents are collaborating...", expanded=True) as status:
-                final_state = None
-                step_count = 0
-                
-                try:
-                    # Stream the graph execution
-                    for step in app.stream(initial_state, config=config):
-                        step_count += 1
-                        progress_bar.progress(min(step_count / max_iterations, 1.0))
-                        
-                        # Get node name and output
-                        node_name = list(step.keys())[0]
-                        node_output = step[node_name]
-                        final_state = node_output
-                        
-                        # Display node output
-                        st.markdown(f"### 🤖 Agent: `{node_name.upper()}`")
-                        
-                        if node_name == "supervisor":
-                            next_step = node_output.get('next_step', 'N/A')
-                            task = node_output.get('current_sub_task', 'N/A')
-                            st.markdown(f"**Decision:** {next_step}")
-                            st.markdown(f"**Task:** {task}")
-                        
-                        elif node_name == "researcher":
-                            findings = node_output.get('research_findings', [])
-                            if findings:
-                                latest = findings[-1]
-                                st.success("✓ Research completed")
-                                with st.expander("View findings"):
-                                    st.write(latest)
-                        
-                        elif node_name == "writer":
-                            draft = node_output.get('draft', '')
-                            revision = node_output.get('revision_number', 0)
-                            st.success(f"✓ Draft {revision} generated")
-                            with st.expander("Preview draft"):
-                                st.write(draft[:500] + "..." if len(draft) > 500 else draft)
-                        
-                        elif node_name == "critiquer":
-                            critique = node_output.get('critique_notes', '')
-                            if "APPROVED" in critique.upper():
-                                st.success("✅ Draft APPROVED!")
-                            else:
-                                st.warning("📝 Revisions requested")
-                                with st.expander("View critique"):
-                                    st.write(critique)
-                        
-                        st.divider()
-                        time.sleep(0.5)
-                    
-                    # Update status when done
-                    status.update(label="✅ Work Complete!", state="complete")
-                    
-                except Exception as e:
-                    status.update(label="❌ Error occurred", state="error")
-                    st.error(f"An error occurred: {str(e)}")
-                    st.exception(e)
+        meta = {}
         
-        # Display final report
-        if final_state and final_state.get("draft"):
-            st.divider()
-            st.header("📄 Final Research Report")
-            
-            # Display report
-            st.markdown(final_state["draft"])
-            
-            # Display metadata
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.subheader("📊 Report Statistics")
-                st.metric("Revisions", final_state.get("revision_number", 0))
-                st.metric("Research Sources", len(final_state.get("research_findings", [])))
-                st.metric("Word Count", len(final_state["draft"].split()))
-            
-            with col2:
-                st.subheader("🔍 Research Findings")
-                with st.expander("View all research data"):
-                    for idx, finding in enumerate(final_state.get("research_findings", []), 1):
-                        st.markdown(f"**Finding {idx}:**")
-                        st.write(finding)
-                        st.divider()
+        if use_checkpoints:
+            run_id = uuid.uuid4().hex[:12]
+            meta["run_id"] = run_id
             
-            # Download button
-            st.download_button(
-                label="📥 Download Report",
-                data=final_state["draft"],
-                file_name=f"research_report_{topic.replace(' ', '_')}.txt",
-                mime="text/plain"
+            checkpointed_app = load_checkpointed_app()
+            job = job_store.submit(
+                session_id,
+                topic,
+                lambda: iter_run_events(checkpointed_app, start_state, run_config(run_id, **config)),
+                finalize=lambda: get_run_state(checkpointed_app, run_id).values,
+                meta=meta
             )
         else:
-            st.error("❌ No report was generated. Please try again.")
+            graph_app = load_app()
+            # Node updates are merged into run_state as they arrive; it is the job's result
+            run_state = dict(start_state)
+            job = job_store.submit(
+                session_id,
+                topic,
+                lambda: iter_run_events(graph_app, start_state, config, run_state),
+                finalize=lambda: run_state,
+                meta=meta
+            )
+        
+        st.query_params["job"] = job.job_id
+
+# Resume a checkpointed run
+elif resume_clicked:
+    checkpointed_app = load_checkpointed_app()
+    snapshot = get_run_state(checkpointed_app, resume_run_id)
+    resumed_topic = snapshot.values.get("main_task", resume_run_id)
+    
+    if snapshot.next:
+        st.info(f"🔁 Resuming run `{resume_run_id}` ({resumed_topic}) at: {', '.join(snapshot.next)}")
+        job = job_store.submit(
+            session_id,
+            resumed_topic,
+            lambda: resume_run_events(checkpointed_app, resume_run_id, config),
+            finalize=lambda: get_run_state(checkpointed_app, resume_run_id).values,
+            meta={"run_id": resume_run_id}
+        )
+        st.query_params["job"] = job.job_id
+    else:
+        st.query_params.pop("job", None)
+        st.session_state["last_trace"] = snapshot.values.get("trace", [])
+        st.info(f"✅ Run `{resume_run_id}` ({resumed_topic}) already finished.")
+        render_report(snapshot.values, resumed_topic)
+
+# Attach to the selected job, whether it is still running or already finished
+active_job_id = st.query_params.get("job")
+if active_job_id:
+    active_job = job_store.get(active_job_id)
+    if active_job and active_job.session_id == session_id:
+        render_job(active_job, max_iterations)
+    else:
+        st.query_params.pop("job", None)
+        st.warning("⚠️ That run is no longer available.")
+
+# Per-run trace breakdown (rendered last so it reflects the run above)
+with st.sidebar:
+    render_trace_panel(st.session_state.get("last_trace"))
 
 # Footer
 st.divider()
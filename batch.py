@@ -0,0 +1,136 @@
+# batch.py
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+# Load environment variables before the agent modules read their settings
+load_dotenv()
+
+from graph import get_async_app, create_checkpointer, initial_state, MAX_PARALLEL_RESEARCH, WRITER_MODE, REVIEW_MODE
+from blobs import hydrate, collect_garbage
+from budget import RUN_TOKEN_BUDGET, RUN_COST_BUDGET, RUN_TIME_BUDGET
+
+# --- 1. Input and Output ---
+
+def load_topics(path):
+    """Reads topics from a text file (one per line) or a JSONL file with a "topic" field."""
+    topics = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                line = json.loads(line).get("topic", "").strip()
+            if line and line not in topics:
+                topics.append(line)
+    return topics
+
+def completed_topics(path):
+    """Returns the topics that already finished successfully in an output file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run interrupted mid-write leaves a partial last line
+                continue
+            if record.get("status") == "ok":
+                done.add(record.get("topic"))
+    return done
+
+# --- 2. Batch Execution ---
+
+async def run_topic(topic, semaphore, config, writer_mode=WRITER_MODE, budget=None, review_mode=REVIEW_MODE):
+    """Runs one research topic and returns its JSONL record."""
+    async with semaphore:
+        print(f"▶ Starting: {topic}")
+        started_at = time.time()
+        start = time.perf_counter()
+
+        try:
+            # The graph state refers to large texts by blob ID; the record gets the texts
+            state = await asyncio.to_thread(hydrate, await get_async_app().ainvoke(initial_state(topic, writer_mode, budget, review_mode), config=config))
+            status, error = "ok", None
+        except Exception as e:
+            print(f"Batch error on '{topic}': {e}")
+            state, status, error = None, "error", str(e)
+
+        elapsed = time.perf_counter() - start
+        print(f"{'✓' if status == 'ok' else '✗'} Finished in {elapsed:.1f}s: {topic}")
+
+        return {
+            "topic": topic,
+            "status": status,
+            "error": error,
+            "started_at": started_at,
+            "elapsed_seconds": round(elapsed, 3),
+            "state": state
+        }
+
+async def run_batch(topics, output_path, concurrency=4, config=None, writer_mode=WRITER_MODE, budget=None, review_mode=REVIEW_MODE):
+    """Runs topics with bounded concurrency, appending each record to output_path as it finishes."""
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(run_topic(topic, semaphore, config or {}, writer_mode, budget, review_mode)) for topic in topics]
+
+    failures = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for finished in asyncio.as_completed(tasks):
+            record = await finished
+            failures += record["status"] != "ok"
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+    return failures
+
+# --- 3. CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate research reports for many topics without the UI.")
+    parser.add_argument("topics", help="Text file with one topic per line, or JSONL with a \"topic\" field")
+    parser.add_argument("-o", "--output", default="reports.jsonl", help="JSONL file that receives one record per run")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Number of research runs executed at the same time")
+    parser.add_argument("--recursion-limit", type=int, default=15, help="Maximum number of agent interactions per run")
+    parser.add_argument("--parallel-research", type=int, default=MAX_PARALLEL_RESEARCH, help="Researcher branches per run running at the same time")
+    parser.add_argument("--writer-mode", choices=["single", "map_reduce"], default=WRITER_MODE, help="Write each report in one call or as parallel sections")
+    parser.add_argument("--review-mode", choices=["fused", "separate"], default=REVIEW_MODE, help="Critique and route in one call, or critique then supervisor")
+    parser.add_argument("--max-tokens", type=int, default=RUN_TOKEN_BUDGET, help="Token budget per run (0 = unlimited)")
+    parser.add_argument("--max-cost", type=float, default=RUN_COST_BUDGET, help="Dollar budget per run (0 = unlimited)")
+    parser.add_argument("--max-seconds", type=float, default=RUN_TIME_BUDGET, help="Time budget per run in seconds (0 = unlimited)")
+    parser.add_argument("--no-resume", action="store_true", help="Re-run topics that already succeeded in the output file")
+    args = parser.parse_args(argv)
+
+    topics = load_topics(args.topics)
+    if not args.no_resume:
+        done = completed_topics(args.output)
+        skipped = [t for t in topics if t in done]
+        topics = [t for t in topics if t not in done]
+        if skipped:
+            print(f"Skipping {len(skipped)} completed topics")
+
+    if not topics:
+        print("Nothing to do.")
+        return 0
+
+    print(f"Running {len(topics)} topics with concurrency {args.concurrency}")
+    config = {"recursion_limit": args.recursion_limit, "max_concurrency": args.parallel_research}
+    budget = {"tokens": args.max_tokens, "cost": args.max_cost, "seconds": args.max_seconds}
+
+    start = time.perf_counter()
+    failures = asyncio.run(run_batch(topics, args.output, args.concurrency, config, args.writer_mode, budget, args.review_mode))
+    print(f"Done in {time.perf_counter() - start:.1f}s: {len(topics) - failures} succeeded, {failures} failed")
+
+    # Batch runs keep no checkpoints, so their blobs go once the grace period has passed
+    collect_garbage(create_checkpointer())
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,398 @@
+# benchmark.py
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import statistics
+
+# Offline runs must never reach the real providers or the user's caches
+os.environ.setdefault("TOGETHER_API_KEY", "offline-benchmark")
+os.environ.setdefault("TAVILY_API_KEY", "offline-benchmark")
+os.environ.setdefault("TOGETHER_RPS", "100000")
+os.environ.setdefault("TAVILY_RPS", "100000")
+_offline_dir = tempfile.mkdtemp(prefix="benchmark-")
+os.environ.setdefault("CACHE_DB", os.path.join(_offline_dir, "cache.sqlite"))
+os.environ.setdefault("BLOB_DB", os.path.join(_offline_dir, "blobs.sqlite"))
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage
+import agents
+import graph
+from cache import CachedSearchTool
+
+NODES = ("supervisor", "researcher", "writer", "critiquer")
+
+# --- 1. Local Stand-ins ---
+
+def _words(prefix, count):
+    return " ".join(f"{prefix}{i % 97}" for i in range(count))
+
+class FakeSearchTool:
+    """Deterministic stand-in for TavilySearch with a fixed latency."""
+
+    max_results = 5
+    topic = "general"
+    search_depth = "basic"
+    include_raw_content = False
+
+    def __init__(self, latency=0.2, result_chars=600):
+        self.latency = latency
+        self.result_chars = result_chars
+        self.calls = 0
+
+    def _response(self, tool_input):
+        query = tool_input.get("query", "") if isinstance(tool_input, dict) else str(tool_input)
+        content = (f"{query} evidence sentence with figures 42 and 2024. " * 50)[:self.result_chars]
+        return {
+            "query": query,
+            "results": [
+                {"title": f"{query} source {i}", "url": f"https://example.com/{i}", "content": content}
+                for i in range(self.max_results)
+            ]
+        }
+
+    def invoke(self, tool_input, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._response(tool_input)
+
+    async def ainvoke(self, tool_input, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._response(tool_input)
+
+class FakeLLM:
+    """Deterministic stand-in for ChatTogether that answers according to a Scenario.
+
+    Latency is latency + token_latency per output token, and the prompt sizes
+    it receives are recorded per prompt kind.
+    """
+
+    model_name = "offline/fake-model"
+    temperature = 0.3
+    max_tokens = 4096
+
+    def __init__(self, scenario, latency=0.5, token_latency=0.0, writer_words=800, summary_words=80):
+        self.scenario = scenario
+        self.latency = latency
+        self.token_latency = token_latency
+        self.writer_words = writer_words
+        self.summary_words = summary_words
+        self.prompt_chars = {}
+        self.drafts = 0
+
+    def _respond(self, prompt):
+        if "research project supervisor" in prompt:
+            kind, text = "supervisor", self.scenario.supervisor(prompt)
+        elif "Critique Agent" in prompt:
+            kind, text = "critique", self.scenario.critique()
+        elif "Reviewer Agent" in prompt:
+            kind, text = "review", self.scenario.review()
+        elif "Plan the body sections" in prompt:
+            kind, text = "outline", json.dumps({
+                "title": "Report",
+                "sections": [{"heading": f"Section {i}", "focus": "Evidence", "findings": [i]} for i in range(1, 5)]
+            })
+        elif "Section to Write:" in prompt:
+            heading = prompt.split("Section to Write:")[1].split("\n")[0].strip()
+            kind, text = "section", f"## {heading}\n{_words('finding', self.writer_words // 4)}"
+        elif "frame them into one coherent report" in prompt:
+            kind, text = "merge", f"## Introduction\n{_words('intro', 60)}\n\n## Conclusion\n{_words('outro', 60)}"
+        elif "report Writer" in prompt:
+            self.drafts += 1
+            # Each draft adds its own paragraph, so revisions change as a real writer's would
+            body = f"{_words('finding', self.writer_words // 4)}\n{_words(f'revision{self.drafts}x', self.writer_words // 16)}"
+            sections = [f"## Section {i}\n{body}" for i in range(1, 5)]
+            if "Sections to Revise" in prompt:
+                # Only the requested sections come back from a section revision
+                requested = prompt.split("Sections to Revise:")[1].split("Critique Notes:")[0]
+                sections = [s for s in sections if s.split("\n")[0] in requested]
+            kind, text = "writer", "# Report\n\n" * ("Sections to Revise" not in prompt) + "\n\n".join(sections)
+        elif "running digest" in prompt:
+            kind, text = "digest", _words("digest", self.summary_words * 2)
+        else:
+            kind, text = "summary", "\n".join(f"- {_words('fact', self.summary_words // 6)}" for _ in range(6))
+
+        self.prompt_chars.setdefault(kind, []).append(len(prompt))
+        return text
+
+    def _delay(self, text):
+        return self.latency + self.token_latency * len(text) / 4
+
+    @staticmethod
+    def _usage(prompt, text):
+        input_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def invoke(self, prompt, **kwargs):
+        text = self._respond(prompt)
+        time.sleep(self._delay(text))
+        return AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+
+    async def ainvoke(self, prompt, **kwargs):
+        text = self._respond(prompt)
+        await asyncio.sleep(self._delay(text))
+        return AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+
+    def stream(self, prompt, **kwargs):
+        yield self.invoke(prompt, **kwargs)
+
+    async def astream(self, prompt, **kwargs):
+        yield await self.ainvoke(prompt, **kwargs)
+
+# --- 2. Scenarios ---
+
+# A different note each round, so critique convergence does not end scripted revisions early
+CRITIQUE_NOTES = (
+    "Expand section {section} with more evidence and add a comparison table.",
+    "Section {section} cites no recent sources; add current figures and explain how they were measured.",
+    "Tighten the argument in section {section}: remove repetition and state its main limitation plainly.",
+)
+
+class Scenario:
+    """Scripted supervisor and critique behaviour for one benchmark run."""
+
+    def __init__(self, name, revisions=1, research_rounds=1, sub_tasks=3):
+        self.name = name
+        self.revisions = revisions
+        self.research_rounds = research_rounds
+        self.sub_tasks = sub_tasks
+        self.reset()
+
+    def reset(self):
+        self.critiques = 0
+        self.rounds = 0
+
+    def supervisor(self, prompt):
+        # One more research round after each rejected draft until the scripted rounds are used up
+        if "No research yet" in prompt or (self.rounds <= self.critiques and self.rounds < self.research_rounds):
+            self.rounds += 1
+            return json.dumps({
+                "next_step": "researcher",
+                "task_description": "Research the topic",
+                "sub_tasks": [f"benchmark query {i}" for i in range(self.sub_tasks)]
+            })
+
+        return json.dumps({"next_step": "writer", "task_description": "Revise the draft based on critique"})
+
+    def critique(self):
+        self.critiques += 1
+        if self.critiques >= self.revisions:
+            return "APPROVED"
+        return CRITIQUE_NOTES[(self.critiques - 1) % len(CRITIQUE_NOTES)].format(section=self.critiques)
+
+    def review(self):
+        # Fused review: the scripted critique plus the step the supervisor would have chosen
+        critique = self.critique()
+        if critique == "APPROVED":
+            return json.dumps({"verdict": "approved", "feedback": "", "next_step": "END"})
+        if self.rounds < self.research_rounds:
+            self.rounds += 1
+            return json.dumps({
+                "verdict": "revise",
+                "feedback": critique,
+                "next_step": "researcher",
+                "research_queries": [f"benchmark query {self.rounds}.{i}" for i in range(self.sub_tasks)]
+            })
+        return json.dumps({"verdict": "revise", "feedback": critique, "next_step": "writer"})
+
+SCENARIOS = {
+    "first_pass": lambda: Scenario("first_pass", revisions=1, research_rounds=1),
+    "three_revisions": lambda: Scenario("three_revisions", revisions=3, research_rounds=1),
+    "repeated_research": lambda: Scenario("repeated_research", revisions=3, research_rounds=3),
+}
+
+# --- 3. Measurement ---
+
+class NodeTimer(BaseCallbackHandler):
+    """Callback handler that times each graph node run."""
+
+    def __init__(self):
+        self.starts = {}
+        self.durations = {}
+        self.intervals = []
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node in NODES and kwargs.get("name") == node:
+            self.starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id in self.starts:
+            node, start = self.starts.pop(run_id)
+            end = time.perf_counter()
+            self.durations.setdefault(node, []).append(end - start)
+            self.intervals.append((start, end))
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+    def busy_seconds(self):
+        """Wall time during which at least one node was running (parallel branches overlap)."""
+        busy, current_start, current_end = 0.0, None, None
+        for start, end in sorted(self.intervals):
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    busy += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            busy += current_end - current_start
+        return busy
+
+def _state_chars(state):
+    return len(json.dumps(state, default=str))
+
+def run_scenario(name, args):
+    """Runs one scenario against the local stand-ins and returns its measurements."""
+    scenario = SCENARIOS[name]()
+    fake_llm = FakeLLM(scenario, args.llm_latency, args.token_latency, args.writer_words, args.summary_words)
+    fake_search = FakeSearchTool(args.search_latency, args.result_chars)
+
+    agents.configure(llm=fake_llm, search_tool=CachedSearchTool(fake_search, agents.search_cache))
+    agents.search_cache.clear()
+    agents.llm_cache.clear()
+    agents.knowledge.clear()
+
+    timer = NodeTimer()
+    config = {"recursion_limit": 50, "max_concurrency": args.parallel_research, "callbacks": [timer]}
+    state_sizes = []
+
+    async def drive():
+        async for values in graph.get_async_app().astream(graph.initial_state("Benchmark topic", args.writer_mode, review_mode=args.review_mode), config=config, stream_mode="values"):
+            state_sizes.append(_state_chars(values))
+
+    # The nodes' progress prints would dominate the output
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        if args.use_async:
+            asyncio.run(drive())
+        else:
+            for values in graph.get_app().stream(graph.initial_state("Benchmark topic", args.writer_mode, review_mode=args.review_mode), config=config, stream_mode="values"):
+                state_sizes.append(_state_chars(values))
+    elapsed = time.perf_counter() - start
+
+    node_seconds = {node: sum(times) for node, times in timer.durations.items()}
+    return {
+        "end_to_end_seconds": elapsed,
+        "node_seconds": node_seconds,
+        "node_calls": {node: len(times) for node, times in timer.durations.items()},
+        "orchestration_seconds": max(0.0, elapsed - timer.busy_seconds()),
+        "prompt_chars": {kind: max(sizes) for kind, sizes in fake_llm.prompt_chars.items()},
+        "llm_calls": {kind: len(sizes) for kind, sizes in fake_llm.prompt_chars.items()},
+        "search_calls": fake_search.calls,
+        "max_state_chars": max(state_sizes) if state_sizes else 0,
+        "final_state_chars": state_sizes[-1] if state_sizes else 0,
+    }
+
+def _median(runs, path):
+    values = []
+    for run in runs:
+        value = run
+        for key in path:
+            value = value.get(key, {}) if isinstance(value, dict) else {}
+        if isinstance(value, (int, float)):
+            values.append(value)
+    return statistics.median(values) if values else None
+
+def summarize(runs):
+    """Collapses repeated runs of a scenario into their medians."""
+    first = runs[0]
+    summary = {}
+    for key, value in first.items():
+        if isinstance(value, dict):
+            summary[key] = {sub: _median(runs, (key, sub)) for sub in value}
+        else:
+            summary[key] = _median(runs, (key,))
+    return summary
+
+# --- 4. Reporting ---
+
+def print_results(results):
+    for name, result in results.items():
+        print(f"\n=== {name} ===")
+        print(f"End-to-end:     {result['end_to_end_seconds']:.3f}s (orchestration {result['orchestration_seconds']:.3f}s)")
+        for node in NODES:
+            if node in result["node_seconds"]:
+                print(f"  {node:<12} {result['node_seconds'][node]:.3f}s over {result['node_calls'][node]:.0f} runs")
+        print(f"Prompt chars:   {result['prompt_chars']}")
+        print(f"LLM calls:      {result['llm_calls']}")
+        print(f"Search calls:   {result['search_calls']}")
+        print(f"State chars:    max {result['max_state_chars']:.0f}, final {result['final_state_chars']:.0f}")
+
+def compare(results, baseline, tolerance):
+    """Prints the change against a saved baseline and returns the regressed metrics."""
+    regressions = []
+    print("\n=== Baseline comparison ===")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ("end_to_end_seconds", "orchestration_seconds", "max_state_chars"):
+            old, new = baseline[name].get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = "REGRESSION" if change > tolerance else ""
+            print(f"{name:<18} {metric:<22} {old:>10.3f} -> {new:>10.3f} ({change:+.1%}) {flag}")
+            if flag:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+# --- 5. CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the research graph offline with local LLM and search stand-ins.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run (repeatable; default all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; medians are reported")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fixed seconds per LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per output token")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds per search call")
+    parser.add_argument("--writer-words", type=int, default=800, help="Words in each generated draft")
+    parser.add_argument("--summary-words", type=int, default=80, help="Words in each research summary")
+    parser.add_argument("--result-chars", type=int, default=600, help="Characters of content per search result")
+    parser.add_argument("--parallel-research", type=int, default=graph.MAX_PARALLEL_RESEARCH, help="Researcher branches running at the same time")
+    parser.add_argument("--writer-mode", choices=["single", "map_reduce"], default=graph.WRITER_MODE, help="Write drafts in one call or as parallel sections")
+    parser.add_argument("--review-mode", choices=["fused", "separate"], default=agents.REVIEW_MODE, help="Critique and route in one call, or critique then supervisor")
+    parser.add_argument("--no-convergence", action="store_true", help="Run every scripted revision even when drafts stop changing")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Benchmark the async graph")
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' progress output")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--save-baseline", help="Save the results as a baseline JSON file")
+    parser.add_argument("--baseline", help="Compare against a saved baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+    graph.CONVERGENCE_DETECTION = not args.no_convergence
+
+    results = {}
+    for name in args.scenario or sorted(SCENARIOS):
+        runs = [run_scenario(name, args) for _ in range(args.repeat)]
+        results[name] = summarize(runs)
+
+    print_results(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"\n✓ Results saved to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
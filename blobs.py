@@ -0,0 +1,219 @@
+# blobs.py
+
+import os
+import time
+import asyncio
+import hashlib
+import inspect
+import functools
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# --- 1. Settings ---
+
+# Keep large texts (findings, drafts, critiques, digest) out of the graph state, which holds references
+BLOB_STATE = os.environ.get("BLOB_STATE", "1") == "1"
+
+# SQLite file holding the texts; checkpoints refer to it, so it lives as long as they do
+BLOB_DB = os.environ.get("BLOB_DB", os.path.join(".cache", "blobs.sqlite"))
+
+# Shorter texts (e.g. "APPROVED") stay inline
+BLOB_MIN_CHARS = int(os.environ.get("BLOB_MIN_CHARS", "200"))
+
+# Texts kept in memory for hydrating nodes
+BLOB_MEMORY_ENTRIES = int(os.environ.get("BLOB_MEMORY_ENTRIES", "1024"))
+
+# Blobs are removed when runs are deleted and after each batch, and only once no checkpoint refers
+# to them. Unreferenced blobs younger than this are kept, as they may belong to a run still going
+BLOB_GC_GRACE = int(os.environ.get("BLOB_GC_GRACE", str(86400)))
+
+# State fields whose texts are stored as blobs (strings, or lists of strings)
+BLOB_FIELDS = ("research_findings", "draft", "critique_notes", "findings_digest")
+
+REF_PREFIX = "blob:"
+
+# --- 2. Blob Store ---
+
+class MissingBlobError(LookupError):
+    """Raised when a state refers to a blob that is no longer stored."""
+
+    def __init__(self, ref, path, field=None):
+        self.ref = ref
+        self.field = field
+        where = f" (state field {field!r})" if field else ""
+        super().__init__(f"Blob {ref}{where} is missing from {path}")
+
+class BlobStore:
+    """Content-addressed text store: put() returns a reference derived from the text's hash.
+
+    Storing the same text twice keeps one copy. Texts never expire on their
+    own, since checkpoints keep referring to them; collect() removes the ones
+    no checkpoint needs. Recently used texts are also kept in memory, so
+    resolving a run's references rarely touches the disk.
+    """
+
+    def __init__(self, path, memory_entries=BLOB_MEMORY_ENTRIES):
+        self.path = path
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS texts (
+                    ref TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS texts_stored ON texts (stored_at)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def ref_for(text):
+        return REF_PREFIX + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+    def _remember(self, ref, text):
+        self._memory[ref] = text
+        self._memory.move_to_end(ref)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, text):
+        """Stores text and returns its reference."""
+        ref, now = self.ref_for(text), time.time()
+        with self._lock:
+            conn = self._connection()
+            # Always written, so a text removed by collect() is stored again; stored_at restarts its grace period
+            conn.execute("INSERT OR IGNORE INTO texts (ref, text, stored_at) VALUES (?, ?, ?)", (ref, text, now))
+            conn.execute("UPDATE texts SET stored_at = ? WHERE ref = ?", (now, ref))
+            conn.commit()
+            self._remember(ref, text)
+        return ref
+
+    def get_text(self, ref):
+        """Returns the text for a reference; raises MissingBlobError if it is no longer stored."""
+        with self._lock:
+            if ref in self._memory:
+                self._memory.move_to_end(ref)
+                return self._memory[ref]
+            row = self._connection().execute("SELECT text FROM texts WHERE ref = ?", (ref,)).fetchone()
+            if row is None:
+                raise MissingBlobError(ref, self.path)
+            self._remember(ref, row[0])
+            return row[0]
+
+    def collect(self, live_refs, grace=BLOB_GC_GRACE):
+        """Removes blobs that are not in live_refs and were last stored over grace seconds ago.
+
+        Returns the number of blobs removed.
+        """
+        cutoff = time.time() - grace
+        with self._lock:
+            conn = self._connection()
+            stale = [ref for (ref,) in conn.execute("SELECT ref FROM texts WHERE stored_at < ?", (cutoff,))]
+            dead = [ref for ref in stale if ref not in live_refs]
+            conn.executemany("DELETE FROM texts WHERE ref = ?", [(ref,) for ref in dead])
+            conn.commit()
+            for ref in dead:
+                self._memory.pop(ref, None)
+        return len(dead)
+
+    def clear(self):
+        """Removes every blob."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM texts")
+            conn.commit()
+            self._memory.clear()
+
+store = BlobStore(BLOB_DB)
+
+# --- 3. Compact and Hydrated State ---
+
+def is_ref(value):
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+def compact(value):
+    """Replaces long texts (in a string or list) with blob references."""
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    if isinstance(value, str) and len(value) >= BLOB_MIN_CHARS and not is_ref(value):
+        return store.put(value)
+    return value
+
+def resolve(value):
+    """Replaces blob references (in a string or list) with their texts."""
+    if isinstance(value, list):
+        return [resolve(item) for item in value]
+    return store.get_text(value) if is_ref(value) else value
+
+def compact_update(update):
+    """A state update with its large texts moved to the blob store (unchanged if BLOB_STATE=0)."""
+    if not BLOB_STATE or not update:
+        return update
+    return {key: compact(value) if key in BLOB_FIELDS else value for key, value in update.items()}
+
+def _resolve_field(key, value):
+    try:
+        return resolve(value)
+    except MissingBlobError as e:
+        raise MissingBlobError(e.ref, store.path, field=key) from None
+
+def hydrate(state):
+    """A copy of a state (or update) with every blob reference replaced by its text.
+
+    Raises MissingBlobError, naming the reference and field, if a text is no longer stored.
+    """
+    if not state:
+        return state
+    return {key: _resolve_field(key, value) if key in BLOB_FIELDS else value for key, value in state.items()}
+
+def blob_node(node):
+    """Wraps a graph node so it sees full texts and its update stores them as blob references."""
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def blob_backed_node(state):
+            # Blob reads and writes hit SQLite, so they run off the event loop
+            update = await node(await asyncio.to_thread(hydrate, state))
+            return await asyncio.to_thread(compact_update, update)
+    else:
+        @functools.wraps(node)
+        def blob_backed_node(state):
+            return compact_update(node(hydrate(state)))
+    return blob_backed_node
+
+# --- 4. Cleanup ---
+
+def refs_in(value):
+    """Every blob reference found in a (nested) value."""
+    if is_ref(value):
+        return {value}
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return set().union(*(refs_in(item) for item in value))
+    return set()
+
+def checkpoint_refs(checkpointer):
+    """Blob references held by any checkpoint or pending write of a checkpointer."""
+    refs = set()
+    for checkpoint in checkpointer.list(None):
+        refs |= refs_in(checkpoint.checkpoint.get("channel_values", {}))
+        refs |= refs_in([value for _, _, value in checkpoint.pending_writes or []])
+    return refs
+
+def collect_garbage(checkpointer, grace=BLOB_GC_GRACE):
+    """Removes the blobs no checkpoint refers to anymore; returns how many were removed."""
+    removed = store.collect(checkpoint_refs(checkpointer), grace)
+    if removed:
+        print(f"Blobs: removed {removed} unreferenced texts")
+    return removed
@@ -0,0 +1,103 @@
+# budget.py
+
+import os
+from models import node_settings
+
+# --- 1. Settings ---
+
+# Per-run limits; 0 means unlimited
+RUN_TOKEN_BUDGET = int(os.environ.get("RUN_TOKEN_BUDGET", "0"))
+RUN_COST_BUDGET = float(os.environ.get("RUN_COST_BUDGET", "0"))
+RUN_TIME_BUDGET = float(os.environ.get("RUN_TIME_BUDGET", "0"))
+
+# Prices used to turn usage into dollars (one blended LLM rate across node models; Tavily basic search)
+LLM_INPUT_PRICE_PER_MTOK = float(os.environ.get("LLM_INPUT_PRICE_PER_MTOK", "0.60"))
+LLM_OUTPUT_PRICE_PER_MTOK = float(os.environ.get("LLM_OUTPUT_PRICE_PER_MTOK", "0.60"))
+SEARCH_PRICE = float(os.environ.get("SEARCH_PRICE", "0.008"))
+
+# --- 2. Degradation Levels ---
+
+NORMAL, SHORT_SUMMARIES, SMALL_OUTPUTS, SKIP_CRITIQUE, FINISH = range(5)
+
+# Share of the tightest budget at which each level starts
+LEVEL_THRESHOLDS = (
+    (SHORT_SUMMARIES, 0.5),
+    (SMALL_OUTPUTS, 0.7),
+    (SKIP_CRITIQUE, 0.85),
+    (FINISH, 1.0),
+)
+
+LEVEL_NAMES = {
+    NORMAL: "normal",
+    SHORT_SUMMARIES: "shorter research summaries",
+    SMALL_OUTPUTS: "smaller max_tokens",
+    SKIP_CRITIQUE: "critique skipped",
+    FINISH: "finishing with the current draft",
+}
+
+# max_tokens per LLM call kind from SMALL_OUTPUTS on
+DEGRADED_MAX_TOKENS = {"researcher": 384, "writer": 2048, "critique": 512}
+
+def default_budget():
+    """Per-run limits from the environment: {"tokens", "cost", "seconds"} (0 = unlimited)."""
+    return {"tokens": RUN_TOKEN_BUDGET, "cost": RUN_COST_BUDGET, "seconds": RUN_TIME_BUDGET}
+
+# --- 3. Usage ---
+
+def active_seconds(trace):
+    """Wall time during which at least one node ran; parallel branches overlap, pauses do not count."""
+    intervals = sorted((s["start_time"], s["start_time"] + s["duration"]) for s in trace)
+    total, current_start, current_end = 0.0, None, None
+    for start, end in intervals:
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+def usage(state):
+    """Tokens, dollars, seconds and paid searches spent so far, read from the run's trace spans."""
+    trace = state.get("trace", [])
+    input_tokens = sum(span["input_tokens"] for span in trace)
+    output_tokens = sum(span["output_tokens"] for span in trace)
+    searches = sum(span.get("calls", {}).get("search", 0) for span in trace)
+    cost = (
+        input_tokens * LLM_INPUT_PRICE_PER_MTOK / 1e6
+        + output_tokens * LLM_OUTPUT_PRICE_PER_MTOK / 1e6
+        + searches * SEARCH_PRICE
+    )
+    return {
+        "tokens": input_tokens + output_tokens,
+        "cost": cost,
+        "seconds": active_seconds(trace),
+        "searches": searches,
+    }
+
+def budget_fraction(state):
+    """Share of the tightest limit used so far (0.0 when the run has no limits)."""
+    budget = state.get("budget") or {}
+    spent = usage(state)
+    fractions = [spent[kind] / limit for kind, limit in budget.items() if limit and kind in spent]
+    return max(fractions, default=0.0)
+
+def degradation_level(state):
+    """Degradation level for the run's current spend."""
+    fraction = budget_fraction(state)
+    level = NORMAL
+    for candidate, threshold in LEVEL_THRESHOLDS:
+        if fraction >= threshold:
+            level = candidate
+    return level
+
+def max_tokens_for(kind, level):
+    """Reduced max_tokens for an LLM call kind at a degradation level, or None for the default.
+
+    Never above the node's own max_tokens, so degrading cannot raise a configured cap.
+    """
+    if level < SMALL_OUTPUTS or kind not in DEGRADED_MAX_TOKENS:
+        return None
+    return min(DEGRADED_MAX_TOKENS[kind], node_settings(kind)["max_tokens"])
@@ -0,0 +1,232 @@
+# cache.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from tracing import record_cache, record_saved
+
+# --- 1. Helpers ---
+
+def make_key(*parts):
+    """Builds a stable cache key from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def normalize_query(query):
+    """Normalizes a search query so trivially re-cased or re-spaced queries match."""
+    return " ".join(str(query).lower().split())
+
+# --- 2. Disk-backed Cache ---
+
+class SQLiteCache:
+    """Key/value cache stored in a local SQLite file.
+
+    Entries expire after their TTL, and the least recently used entries are
+    evicted once the table holds more than max_entries rows. The connection is
+    opened on first use so creating a cache has no side effects.
+    """
+
+    def __init__(self, path, table="cache", ttl=86400, max_entries=1000):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    expires_at REAL
+                )"""
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or (row[1] is not None and row[1] <= now):
+                if row is not None:
+                    conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Stores a JSON-serializable value under key."""
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl else None
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"""INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)""",
+                (key, json.dumps(value, default=str), now, now, expires_at)
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        """Drops expired entries, then the least recently used ones over the size bound."""
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+        count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                f"""DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT ?
+                )""",
+                (overflow,)
+            )
+            self.evictions += overflow
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+
+    def stats(self):
+        """Returns hit/miss counters for this cache."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# --- 3. Search Tool Cache ---
+
+# Tool settings that change what a search returns
+SEARCH_PARAMS = ("max_results", "topic", "search_depth", "include_raw_content")
+
+class CachedSearchTool:
+    """Wraps a search tool so repeated queries are answered from a SQLiteCache."""
+
+    def __init__(self, tool, cache):
+        self.tool = tool
+        self.cache = cache
+
+    def _key(self, tool_input):
+        if isinstance(tool_input, dict):
+            query = tool_input.get("query", "")
+            overrides = {k: v for k, v in tool_input.items() if k != "query"}
+        else:
+            query, overrides = tool_input, {}
+
+        params = {name: getattr(self.tool, name, None) for name in SEARCH_PARAMS}
+        params.update(overrides)
+        return make_key("search", normalize_query(query), params)
+
+    @staticmethod
+    def _cacheable(response):
+        # Failed searches come back as an error payload rather than an exception
+        return not (isinstance(response, dict) and response.get("error"))
+
+    def invoke(self, tool_input, **kwargs):
+        key = self._key(tool_input)
+        cached = self.cache.get(key)
+        record_cache("search", cached is not None)
+        if cached is not None:
+            return cached
+
+        response = self.tool.invoke(tool_input, **kwargs)
+        if self._cacheable(response):
+            self.cache.set(key, response)
+        return response
+
+    async def ainvoke(self, tool_input, **kwargs):
+        key = self._key(tool_input)
+        cached = self.cache.get(key)
+        record_cache("search", cached is not None)
+        if cached is not None:
+            return cached
+
+        response = await self.tool.ainvoke(tool_input, **kwargs)
+        if self._cacheable(response):
+            self.cache.set(key, response)
+        return response
+
+    def __getattr__(self, name):
+        # Expose the wrapped tool's settings (max_results, topic, ...)
+        return getattr(self.tool, name)
+
+# --- 4. LLM Response Cache ---
+
+class LLMResponseCache(SQLiteCache):
+    """SQLiteCache for LLM completions that also tracks the latency and tokens saved by hits."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def key_for(llm, prompt, max_tokens=None):
+        """Content-addressed key: model settings (max_tokens may be overridden per call) plus the rendered prompt."""
+        return make_key(
+            "llm",
+            getattr(llm, "model_name", None) or getattr(llm, "model", None),
+            getattr(llm, "temperature", None),
+            max_tokens or getattr(llm, "max_tokens", None),
+            prompt
+        )
+
+    def lookup(self, key):
+        """Returns a cached completion text, crediting its original cost on a hit."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+
+        with self._lock:
+            self.saved_seconds += entry.get("latency", 0.0)
+            self.saved_tokens += entry.get("total_tokens", 0)
+        record_saved(entry.get("latency", 0.0), entry.get("total_tokens", 0))
+        return entry.get("content")
+
+    def store(self, key, content, latency, total_tokens=0):
+        """Stores a completion with the latency and tokens it cost to produce."""
+        self.set(key, {"content": content, "latency": latency, "total_tokens": total_tokens})
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "saved_seconds": round(self.saved_seconds, 3),
+            "saved_tokens": self.saved_tokens,
+        })
+        return stats
@@ -0,0 +1,318 @@
+# clients.py
+
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+import weakref
+import httpx
+from tracing import record_call, record_provider
+
+# --- 1. Settings ---
+
+# HTTP statuses worth retrying: rate limits and transient server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Pooled connections for LLM calls (one pool per event loop for async calls)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "120"))
+
+# --- 2. Rate Limiting ---
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by threads and event loops.
+
+    rate tokens are added per second up to capacity; each request takes one.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Takes a token and returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        """Blocks until a request may be sent; returns the time spent waiting."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self):
+        """Async counterpart of acquire."""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+# --- 3. Retry Policy ---
+
+def _status_code(error):
+    for source in (error, getattr(error, "response", None)):
+        status = getattr(source, "status_code", None) or getattr(source, "http_status", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+def is_retryable(error):
+    """Whether an error is a rate limit, transient server error or connection failure."""
+    if isinstance(error, StreamInterrupted):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+
+    name = type(error).__name__
+    message = str(error).lower()
+    return (
+        isinstance(error, (httpx.TimeoutException, httpx.NetworkError))
+        or "Timeout" in name
+        or "Connection" in name
+        or "rate limit" in message
+        or "429" in message
+    )
+
+def is_rate_limited(error):
+    """Whether an error is the provider refusing a request over its rate limit, not a model failure."""
+    status = _status_code(error)
+    if status is not None:
+        return status == 429
+    message = str(error).lower()
+    return "rate limit" in message or "429" in message
+
+def _retry_after(error):
+    """Reads a Retry-After header (in seconds) from an HTTP error, if present."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class ProviderError(Exception):
+    """Raised when a provider reports a failure in its payload instead of raising."""
+
+class StreamInterrupted(Exception):
+    """Raised when a stream fails after emitting chunks; a retry would emit them again."""
+
+# --- 4. Providers ---
+
+# How long the latest provider request in each context took, without rate-limit waits or backoff
+_request_seconds = contextvars.ContextVar("request_seconds", default=None)
+
+def take_request_seconds():
+    """Returns and clears how long this context's latest provider request took, or None if none ran."""
+    seconds = _request_seconds.get()
+    _request_seconds.set(None)
+    return seconds
+
+def _timed(fn, *args, **kwargs):
+    start = time.monotonic()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _request_seconds.set(time.monotonic() - start)
+
+async def _atimed(fn, *args, **kwargs):
+    start = time.monotonic()
+    try:
+        return await fn(*args, **kwargs)
+    finally:
+        _request_seconds.set(time.monotonic() - start)
+
+class Provider:
+    """Shared access point for one upstream API: rate limit, retries and metrics."""
+
+    def __init__(self, name, rate, burst=None, max_retries=5, base_delay=1.0, max_delay=30.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._metrics = {
+            "calls": 0,
+            "retries": 0,
+            "failures": 0,
+            "queue_seconds": 0.0,
+            "max_queue_seconds": 0.0,
+            "backoff_seconds": 0.0,
+        }
+
+    def _record(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                if key == "max_queue_seconds":
+                    self._metrics[key] = max(self._metrics[key], value)
+                else:
+                    self._metrics[key] += value
+
+    def _backoff(self, attempt, error):
+        """Jittered exponential backoff, honouring Retry-After when the provider sends it."""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def call(self, fn, *args, **kwargs):
+        """Calls fn under the rate limit, retrying retryable errors."""
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire()
+            self._record(calls=1, queue_seconds=waited, max_queue_seconds=waited)
+            record_provider(self.name, waited)
+            try:
+                return _timed(fn, *args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._record(failures=1)
+                    raise
+                delay = self._backoff(attempt, e)
+                print(f"{self.name} error ({e}), retrying in {delay:.1f}s")
+                self._record(retries=1, backoff_seconds=delay)
+                record_provider(self.name, retry=True)
+                time.sleep(delay)
+
+    async def acall(self, fn, *args, **kwargs):
+        """Async counterpart of call; fn returns an awaitable."""
+        for attempt in range(self.max_retries + 1):
+            waited = await self.bucket.aacquire()
+            self._record(calls=1, queue_seconds=waited, max_queue_seconds=waited)
+            record_provider(self.name, waited)
+            try:
+                return await _atimed(fn, *args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._record(failures=1)
+                    raise
+                delay = self._backoff(attempt, e)
+                print(f"{self.name} error ({e}), retrying in {delay:.1f}s")
+                self._record(retries=1, backoff_seconds=delay)
+                record_provider(self.name, retry=True)
+                await asyncio.sleep(delay)
+
+    def metrics(self):
+        """Returns call, retry and queueing-delay counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["avg_queue_seconds"] = metrics["queue_seconds"] / metrics["calls"] if metrics["calls"] else 0.0
+        return metrics
+
+PROVIDERS = {
+    "together": Provider(
+        "together",
+        rate=float(os.environ.get("TOGETHER_RPS", "10")),
+        burst=int(os.environ.get("TOGETHER_BURST", "10")),
+        max_retries=int(os.environ.get("TOGETHER_MAX_RETRIES", "5"))
+    ),
+    "tavily": Provider(
+        "tavily",
+        rate=float(os.environ.get("TAVILY_RPS", "5")),
+        burst=int(os.environ.get("TAVILY_BURST", "5")),
+        max_retries=int(os.environ.get("TAVILY_MAX_RETRIES", "5"))
+    ),
+}
+
+def get_provider(name):
+    """Returns the shared Provider for an upstream API."""
+    return PROVIDERS[name]
+
+def metrics():
+    """Returns metrics for every provider."""
+    return {name: provider.metrics() for name, provider in PROVIDERS.items()}
+
+# --- 5. Clients ---
+
+def _limits():
+    return httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+
+_http_client = None
+_async_http_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def running_loop():
+    """Returns the running event loop, or None outside of one."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def http_clients():
+    """Returns the pooled (sync, async) httpx clients.
+
+    The sync client is shared by the whole process. An async client's connections
+    belong to the event loop that opened them, so each running loop (e.g. each
+    asyncio.run in batch.py or the benchmark) gets its own; outside a loop a new,
+    unbound one is returned.
+    """
+    global _http_client
+    loop = running_loop()
+    with _clients_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_limits(), timeout=HTTP_TIMEOUT)
+        if loop is None:
+            return _http_client, httpx.AsyncClient(limits=_limits(), timeout=HTTP_TIMEOUT)
+        if loop not in _async_http_clients:
+            _async_http_clients[loop] = httpx.AsyncClient(limits=_limits(), timeout=HTTP_TIMEOUT)
+        return _http_client, _async_http_clients[loop]
+
+def create_llm(**kwargs):
+    """Creates a ChatTogether model on the pooled HTTP clients.
+
+    Its async calls must run on the event loop it was created in (or, if created
+    outside of one, a single loop). The SDK's own retries are disabled; the "together" Provider retries instead
+    so every call shares one rate limit and backoff policy.
+    """
+    from langchain_together import ChatTogether
+
+    http_client, http_async_client = http_clients()
+    return ChatTogether(
+        http_client=http_client,
+        http_async_client=http_async_client,
+        max_retries=0,
+        **kwargs
+    )
+
+class RateLimitedTool:
+    """Wraps a search tool so calls go through a Provider's rate limit and retries."""
+
+    def __init__(self, tool, provider):
+        self.tool = tool
+        self.provider = provider
+
+    @staticmethod
+    def _check(response):
+        # Tavily reports failures (including 429s) as an error payload
+        if isinstance(response, dict) and response.get("error"):
+            raise ProviderError(str(response["error"]))
+        return response
+
+    def invoke(self, tool_input, **kwargs):
+        def search():
+            response = self._check(self.tool.invoke(tool_input, **kwargs))
+            record_call("search")
+            return response
+        return self.provider.call(search)
+
+    async def ainvoke(self, tool_input, **kwargs):
+        async def search():
+            response = self._check(await self.tool.ainvoke(tool_input, **kwargs))
+            record_call("search")
+            return response
+        return await self.provider.acall(search)
+
+    def __getattr__(self, name):
+        # Expose the wrapped tool's settings (max_results, topic, ...)
+        return getattr(self.tool, name)
@@ -0,0 +1,103 @@
+# digest.py
+
+import os
+import re
+from tracing import record_error
+
+# --- 1. Prompt Budgets ---
+
+# Rough conversion used for budgeting; Mixtral averages about 4 characters per token
+CHARS_PER_TOKEN = 4
+
+# Token budgets for the parts of each prompt that grow with the run
+DIGEST_TOKEN_BUDGET = int(os.environ.get("DIGEST_TOKEN_BUDGET", "1200"))
+OUTLINE_TOKEN_BUDGET = int(os.environ.get("OUTLINE_TOKEN_BUDGET", "300"))
+CRITIQUE_TOKEN_BUDGET = int(os.environ.get("CRITIQUE_TOKEN_BUDGET", "400"))
+WRITER_FINDINGS_TOKEN_BUDGET = int(os.environ.get("WRITER_FINDINGS_TOKEN_BUDGET", "6000"))
+
+# --- 2. Helpers ---
+
+def estimate_tokens(text):
+    """Estimates the token count of a text."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_to_tokens(text, budget):
+    """Cuts text down to a token budget, preferring to stop at a line break."""
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+
+    cut = text[:limit]
+    newline = cut.rfind("\n")
+    if newline > limit // 2:
+        cut = cut[:newline]
+    return cut.rstrip() + "\n[...truncated]"
+
+def _first_sentence(text, max_chars=160):
+    sentence = re.split(r"(?<=[.!?])\s", " ".join(text.split()), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+# --- 3. Draft Outline ---
+
+def outline_draft(draft, budget=OUTLINE_TOKEN_BUDGET):
+    """Builds a compact outline of a draft: headings plus the lead sentence of each block."""
+    if not draft or not draft.strip():
+        return ""
+
+    lines = [f"({len(draft.split())} words)"]
+    for block in re.split(r"\n\s*\n", draft.strip()):
+        block_lines = [l.strip() for l in block.strip().splitlines() if l.strip()]
+        if not block_lines:
+            continue
+
+        if block_lines[0].startswith("#"):
+            lines.append(block_lines[0])
+            if len(block_lines) > 1:
+                lines.append("  " + _first_sentence(" ".join(block_lines[1:])))
+        else:
+            lines.append("- " + _first_sentence(" ".join(block_lines)))
+
+    return truncate_to_tokens("\n".join(lines), budget)
+
+# --- 4. Rolling Findings Digest ---
+
+def pending_findings(state):
+    """Returns the findings added since the digest was last updated."""
+    return state.get("research_findings", [])[state.get("digested_count", 0):]
+
+def _combine(digest, new_findings):
+    return "\n---\n".join([part for part in [digest] + list(new_findings) if part])
+
+def merge_findings(digest, new_findings, summarize, budget=DIGEST_TOKEN_BUDGET):
+    """Folds new findings into a rolling digest, re-summarizing only when it overflows the budget.
+
+    summarize(text, budget) compresses text into roughly budget tokens; it may
+    raise, in which case the digest is truncated instead.
+    """
+    combined = _combine(digest, new_findings)
+    if estimate_tokens(combined) <= budget:
+        return combined
+
+    try:
+        summary = summarize(combined, budget)
+    except Exception as e:
+        print(f"Digest error: {e}")
+        record_error(e)
+        summary = ""
+
+    return truncate_to_tokens(summary or combined, budget)
+
+async def amerge_findings(digest, new_findings, asummarize, budget=DIGEST_TOKEN_BUDGET):
+    """Async counterpart of merge_findings."""
+    combined = _combine(digest, new_findings)
+    if estimate_tokens(combined) <= budget:
+        return combined
+
+    try:
+        summary = await asummarize(combined, budget)
+    except Exception as e:
+        print(f"Digest error: {e}")
+        record_error(e)
+        summary = ""
+
+    return truncate_to_tokens(summary or combined, budget)
@@ -1,14 +1,34 @@
 # graph.py
 
+import os
+import sqlite3
+import difflib
 from typing import TypedDict, Annotated, List
 from langgraph.graph import StateGraph, END
+from langgraph.constants import Send
+from langgraph.checkpoint.sqlite import SqliteSaver
 import operator
 from agents import (
     create_supervisor_chain,
     create_researcher_agent,
     create_writer_chain,
-    create_critique_chain
+    create_critique_chain,
+    create_reviewer_chain,
+    create_digest_updater,
+    create_async_supervisor_chain,
+    create_async_researcher_agent,
+    create_async_writer_chain,
+    create_async_critique_chain,
+    create_async_reviewer_chain,
+    create_async_digest_updater,
+    REVIEW_MODE
 )
+from digest import outline_draft
+from sections import changed_sections, sections_text, split_sections, WRITER_MODE
+from budget import default_budget, degradation_level, LEVEL_NAMES
+from retrieval import tokenize
+from tracing import traced
+from blobs import blob_node, collect_garbage
 
 # --- 1. Define the State ---
 
@@ -21,6 +41,58 @@ class ResearchState(TypedDict):
     revision_number: int
     next_step: str
     current_sub_task: str
+    sub_tasks: List[str]
+    findings_digest: str
+    digested_count: int
+    draft_outline: str
+    revised_sections: List[str]
+    writer_mode: str
+    review_mode: str
+    budget: dict
+    budget_level: int
+    convergence: dict
+    termination_reason: str
+    supervisor_llm_calls_avoided: int
+    trace: Annotated[List[dict], operator.add]
+
+# Default cap on researcher branches running at the same time (LangGraph "max_concurrency")
+MAX_PARALLEL_RESEARCH = int(os.environ.get("MAX_PARALLEL_RESEARCH", "4"))
+
+# End the revision loop once successive drafts or critiques stop changing
+CONVERGENCE_DETECTION = os.environ.get("CONVERGENCE_DETECTION", "1") == "1"
+
+# Word-level diff similarity to the previous draft above which a revision counts as unchanged
+DRAFT_CONVERGENCE_THRESHOLD = float(os.environ.get("DRAFT_CONVERGENCE_THRESHOLD", "0.95"))
+
+# Content-word overlap with the previous critique above which it counts as repeated
+CRITIQUE_REPEAT_THRESHOLD = float(os.environ.get("CRITIQUE_REPEAT_THRESHOLD", "0.7"))
+
+# SQLite file holding per-run checkpoints of ResearchState
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB", os.path.join(".cache", "checkpoints.sqlite"))
+
+def initial_state(topic: str, writer_mode: str = WRITER_MODE, budget: dict = None, review_mode: str = REVIEW_MODE) -> dict:
+    """Returns the starting state for a research run on a topic.
+    
+    writer_mode is "single" (one writer call) or "map_reduce" (sections in parallel).
+    review_mode is "fused" (critique and next step in one call) or "separate" (critique, then supervisor).
+    budget is {"tokens", "cost", "seconds"} (0 = unlimited); defaults to the RUN_*_BUDGET settings.
+    """
+    return {
+        "main_task": topic,
+        "research_findings": [],
+        "draft": "",
+        "critique_notes": "",
+        "revision_number": 0,
+        "next_step": "",
+        "current_sub_task": "",
+        "sub_tasks": [],
+        "writer_mode": writer_mode,
+        "review_mode": review_mode,
+        "budget": budget or default_budget(),
+        "budget_level": 0,
+        "convergence": {},
+        "termination_reason": ""
+    }
 
 # --- 2. Initialize Chains and Agents ---
 
@@ -28,25 +100,195 @@ supervisor_chain = create_supervisor_chain()
 researcher_agent = create_researcher_agent()
 writer_chain = create_writer_chain()
 critique_chain = create_critique_chain()
+reviewer_chain = create_reviewer_chain()
+digest_updater = create_digest_updater()
 
-# --- 3. Define Graph Nodes ---
+async_supervisor_chain = create_async_supervisor_chain()
+async_researcher_agent = create_async_researcher_agent()
+async_writer_chain = create_async_writer_chain()
+async_critique_chain = create_async_critique_chain()
+async_reviewer_chain = create_async_reviewer_chain()
+async_digest_updater = create_async_digest_updater()
 
-def supervisor_node(state: ResearchState) -> dict:
-    """Supervisor decides the next step."""
-    print("\n=== SUPERVISOR ===")
+# --- 3. Convergence ---
+
+def draft_similarity(old: str, new: str) -> float:
+    """Share of words two drafts have in common, in order (difflib ratio over words).
     
-    decision = supervisor_chain(state)
+    When the cheap upper bounds already fall below the threshold, the bound is returned.
+    """
+    old_words, new_words = old.split(), new.split()
+    if not old_words or not new_words:
+        return 1.0 if old_words == new_words else 0.0
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    # The bounds are cheap; only compute the full diff when they do not decide the check
+    if matcher.real_quick_ratio() < DRAFT_CONVERGENCE_THRESHOLD or matcher.quick_ratio() < DRAFT_CONVERGENCE_THRESHOLD:
+        return matcher.quick_ratio()
+    return matcher.ratio()
+
+def critique_similarity(old: str, new: str) -> float:
+    """Jaccard overlap of the content words of two critiques."""
+    old_terms, new_terms = set(tokenize(old)), set(tokenize(new))
+    if not old_terms or not new_terms:
+        return 0.0
+    return len(old_terms & new_terms) / len(old_terms | new_terms)
+
+def _draft_convergence(state: ResearchState, draft: str, revised: List[str]) -> dict:
+    """Convergence update for a new draft; sets termination_reason when it barely differs from the last one.
+
+    After a section revision only the revised sections are compared, since the
+    untouched rest of the report would make any revision look unchanged.
+    """
+    old = state.get("draft", "")
+    if not CONVERGENCE_DETECTION or not old.strip():
+        return {}
     
+    if revised and len(revised) < len(split_sections(draft)):
+        old, draft = sections_text(old, revised), sections_text(draft, revised)
+    similarity = draft_similarity(old, draft)
+    update = {"convergence": {
+        **(state.get("convergence") or {}),
+        "draft_similarity": round(similarity, 3),
+        "draft_threshold": DRAFT_CONVERGENCE_THRESHOLD
+    }}
+    if similarity >= DRAFT_CONVERGENCE_THRESHOLD:
+        update["termination_reason"] = (
+            f"Converged: revision is {similarity:.0%} identical to the previous draft "
+            f"(threshold {DRAFT_CONVERGENCE_THRESHOLD:.0%})"
+        )
+    return update
+
+def _critique_convergence(state: ResearchState, critique: str) -> dict:
+    """Convergence update for a new critique; sets termination_reason when it repeats the last one."""
+    old = state.get("critique_notes", "")
+    if not CONVERGENCE_DETECTION or not old or old == "APPROVED":
+        return {}
+    
+    similarity = critique_similarity(old, critique)
+    update = {"convergence": {
+        **(state.get("convergence") or {}),
+        "critique_similarity": round(similarity, 3),
+        "critique_threshold": CRITIQUE_REPEAT_THRESHOLD
+    }}
+    if similarity >= CRITIQUE_REPEAT_THRESHOLD:
+        update["termination_reason"] = (
+            f"Converged: critique repeats the previous one ({similarity:.0%} overlap, "
+            f"threshold {CRITIQUE_REPEAT_THRESHOLD:.0%})"
+        )
+    return update
+
+# --- 4. Define Graph Nodes ---
+
+def _supervisor_update(state: ResearchState, decision: dict) -> dict:
+    """Turns a supervisor decision into a state update."""
     next_step = decision.get("next_step", "researcher")
     task_desc = decision.get("task_description", "Continue work")
+    sub_tasks = decision.get("sub_tasks", [])
+    
+    avoided = state.get("supervisor_llm_calls_avoided", 0)
+    budget_level = degradation_level(state)
     
-    print(f"Decision: {next_step}")
+    if budget_level:
+        print(f"Budget: {LEVEL_NAMES[budget_level]}")
+    print(f"Decision: {next_step}" + (" (fast path)" if decision.get("fast_path") else ""))
     print(f"Task: {task_desc}")
+    if sub_tasks:
+        print(f"Sub-tasks: {sub_tasks}")
     
     return {
         "next_step": next_step,
         "current_sub_task": task_desc,
+        "sub_tasks": sub_tasks,
+        "supervisor_llm_calls_avoided": avoided + 1 if decision.get("fast_path") else avoided,
+        "budget_level": budget_level,
+        **({"termination_reason": task_desc} if next_step == "END" else {}),
+    }
+
+def _write_update(state: ResearchState, draft: str) -> dict:
+    """Turns a new draft into a state update."""
+    print(f"Draft created: {len(draft)} characters")
+    
+    revised = changed_sections(state.get("draft", ""), draft)
+    update = {
+        "draft": draft,
+        "draft_outline": outline_draft(draft),
+        "revised_sections": revised,
+        "revision_number": state.get("revision_number", 0) + 1
     }
+    update.update(_draft_convergence(state, draft, revised))
+    if update.get("termination_reason"):
+        print(f"⏹ {update['termination_reason']}")
+    return update
+
+def _critique_update(state: ResearchState, critique: str) -> dict:
+    """Turns a critique into a state update."""
+    print(f"Critique: {critique[:100]}...")
+    
+    is_approved = "APPROVED" in critique.upper()
+    
+    if is_approved:
+        print("✓ Draft APPROVED")
+        return {
+            "critique_notes": "APPROVED",
+            "next_step": "END"
+        }
+    
+    update = _critique_convergence(state, critique)
+    if update.get("termination_reason"):
+        print(f"⏹ {update['termination_reason']}")
+        next_step = "END"
+    else:
+        print("✗ Revisions needed")
+        next_step = "writer"
+    
+    update.update({
+        "critique_notes": critique,
+        "next_step": next_step
+    })
+    return update
+
+def _review_update(state: ResearchState, review: dict) -> dict:
+    """Turns a fused review into a state update that also carries the next step, so no supervisor turn is needed."""
+    critique = review["critique"]
+    print(f"Critique: {critique[:100]}...")
+    
+    if review["next_step"] == "END":
+        print("✓ Draft APPROVED")
+        return {
+            "critique_notes": "APPROVED",
+            "next_step": "END",
+            "sub_tasks": [],
+            "termination_reason": review["task_description"]
+        }
+    
+    update = _critique_convergence(state, critique)
+    if update.get("termination_reason"):
+        print(f"⏹ {update['termination_reason']}")
+        update.update({"critique_notes": critique, "next_step": "END", "sub_tasks": []})
+        return update
+    
+    print(f"✗ Revisions needed, next: {review['next_step']}")
+    if review["sub_tasks"]:
+        print(f"Sub-tasks: {review['sub_tasks']}")
+    update.update({
+        "critique_notes": critique,
+        "next_step": review["next_step"],
+        "current_sub_task": review["task_description"],
+        "sub_tasks": review["sub_tasks"],
+        "supervisor_llm_calls_avoided": state.get("supervisor_llm_calls_avoided", 0) + 1
+    })
+    return update
+
+def supervisor_node(state: ResearchState) -> dict:
+    """Supervisor decides the next step."""
+    print("\n=== SUPERVISOR ===")
+    
+    # Fold only the findings added since the last turn into the digest
+    digest = digest_updater(state)
+    
+    update = _supervisor_update(state, supervisor_chain({**state, **digest}))
+    update.update(digest)
+    return update
 
 def research_node(state: ResearchState) -> dict:
     """Research node that gathers information."""
@@ -55,13 +297,9 @@ def research_node(state: ResearchState) -> dict:
     sub_task = state.get("current_sub_task", state.get("main_task"))
     print(f"Researching: {sub_task}")
     
-    try:
-        result = researcher_agent.invoke({"input": sub_task})
-        findings = result.get("output", "Research completed")
-        print(f"Found: {findings[:100]}...")
-    except Exception as e:
-        print(f"Research error: {e}")
-        findings = f"Research on {sub_task} - information gathered"
+    result = researcher_agent({"input": sub_task, "budget_level": state.get("budget_level", 0)})
+    findings = result.get("output", "Research completed")
+    print(f"Found: {findings[:100]}...")
     
     return {
         "research_findings": [findings]
@@ -71,61 +309,134 @@ def write_node(state: ResearchState) -> dict:
     """Writer node that creates or revises draft."""
     print("\n=== WRITER ===")
     
-    draft = writer_chain(state)
-    print(f"Draft created: {len(draft)} characters")
+    return _write_update(state, writer_chain(state))
+
+def critique_node(state: ResearchState) -> dict:
+    """Critique node that reviews the draft."""
+    print("\n=== CRITIQUER ===")
+    
+    if state.get("review_mode", REVIEW_MODE) == "fused":
+        return _review_update(state, reviewer_chain(state))
+    return _critique_update(state, critique_chain(state))
+
+async def asupervisor_node(state: ResearchState) -> dict:
+    """Async supervisor node."""
+    print("\n=== SUPERVISOR ===")
+    
+    digest = await async_digest_updater(state)
+    
+    update = _supervisor_update(state, await async_supervisor_chain({**state, **digest}))
+    update.update(digest)
+    return update
+
+async def aresearch_node(state: ResearchState) -> dict:
+    """Async research node."""
+    print("\n=== RESEARCHER ===")
+    
+    sub_task = state.get("current_sub_task", state.get("main_task"))
+    print(f"Researching: {sub_task}")
+    
+    result = await async_researcher_agent({"input": sub_task, "budget_level": state.get("budget_level", 0)})
+    findings = result.get("output", "Research completed")
+    print(f"Found: {findings[:100]}...")
     
     return {
-        "draft": draft,
-        "revision_number": state.get("revision_number", 0) + 1
+        "research_findings": [findings]
     }
 
-def critique_node(state: ResearchState) -> dict:
-    """Critique node that reviews the draft."""
+async def awrite_node(state: ResearchState) -> dict:
+    """Async writer node."""
+    print("\n=== WRITER ===")
+    
+    return _write_update(state, await async_writer_chain(state))
+
+async def acritique_node(state: ResearchState) -> dict:
+    """Async critique node."""
     print("\n=== CRITIQUER ===")
     
-    critique = critique_chain(state)
-    print(f"Critique: {critique[:100]}...")
+    if state.get("review_mode", REVIEW_MODE) == "fused":
+        return _review_update(state, await async_reviewer_chain(state))
+    return _critique_update(state, await async_critique_chain(state))
+
+# --- 5. Routing ---
+
+def route_supervisor(state: ResearchState):
+    """Routes the supervisor decision, fanning research sub-tasks out in parallel."""
+    next_step = state.get("next_step", "researcher")
+    if next_step != "researcher":
+        return next_step
     
-    is_approved = "APPROVED" in critique.upper()
+    sub_tasks = state.get("sub_tasks") or [state.get("current_sub_task") or state.get("main_task", "")]
+    # Recomputed here so the usage of the call that just decided (supervisor or fused reviewer) counts
+    budget_level = degradation_level(state)
     
-    if is_approved:
-        print("✓ Draft APPROVED")
-        return {
-            "critique_notes": "APPROVED",
-            "next_step": "END"
-        }
-    else:
-        print("✗ Revisions needed")
-        return {
-            "critique_notes": critique,
-            "next_step": "writer"
-        }
+    # One researcher branch per sub-task; their findings merge through operator.add
+    return [
+        Send("researcher", {
+            "main_task": state.get("main_task", ""),
+            "current_sub_task": sub_task,
+            "budget_level": budget_level
+        })
+        for sub_task in sub_tasks
+    ]
 
-# --- 4. Build the Graph ---
+def route_review(state: ResearchState):
+    """Routes the critiquer: a fused review already chose the next step, a separate critique goes to the supervisor."""
+    if state.get("termination_reason"):
+        return "END"
+    if state.get("review_mode", REVIEW_MODE) == "fused":
+        return route_supervisor(state)
+    return "supervisor"
 
-def build_graph():
-    """Constructs and compiles the LangGraph workflow."""
+def route_writer(state: ResearchState):
+    """Routes the writer: END once its draft converged, else the critiquer."""
+    return "END" if state.get("termination_reason") else "critiquer"
+
+# --- 6. Build the Graph ---
+
+def build_graph(use_async: bool = False, checkpointer=None):
+    """Constructs and compiles the LangGraph workflow.
+    
+    With use_async=True the nodes are coroutines, so the compiled graph is
+    meant to be driven with ainvoke/astream from an event loop. A checkpointer
+    saves the state after every node under the run's thread_id (async graphs
+    need an async saver such as AsyncSqliteSaver).
+    """
     
     workflow = StateGraph(ResearchState)
     
-    # Add nodes
-    workflow.add_node("supervisor", supervisor_node)
-    workflow.add_node("researcher", research_node)
-    workflow.add_node("writer", write_node)
-    workflow.add_node("critiquer", critique_node)
+    # Add nodes (each traced, so its span lands in state["trace"]; large texts go to the blob store)
+    if use_async:
+        nodes = {"supervisor": asupervisor_node, "researcher": aresearch_node, "writer": awrite_node, "critiquer": acritique_node}
+    else:
+        nodes = {"supervisor": supervisor_node, "researcher": research_node, "writer": write_node, "critiquer": critique_node}
+    
+    for name, node in nodes.items():
+        workflow.add_node(name, traced(name, blob_node(node)))
     
     # Set entry point
     workflow.set_entry_point("supervisor")
     
     # Add edges
     workflow.add_edge("researcher", "supervisor")
-    workflow.add_edge("writer", "critiquer")
-    workflow.add_edge("critiquer", "supervisor")
+    
+    # The revision loop ends early once drafts or critiques stop changing
+    workflow.add_conditional_edges("writer", route_writer, {"critiquer": "critiquer", "END": END})
+    workflow.add_conditional_edges(
+        "critiquer",
+        route_review,
+        {
+            "supervisor": "supervisor",
+            "researcher": "researcher",
+            "writer": "writer",
+            "END": END
+        }
+    )
     
     # Add conditional edges from supervisor
     workflow.add_conditional_edges(
         "supervisor",
-        lambda state: state.get("next_step", "researcher"),
+        route_supervisor,
         {
             "researcher": "researcher",
             "writer": "writer",
@@ -134,8 +445,131 @@ def build_graph():
     )
     
     # Compile the graph
-    app = workflow.compile()
+    app = workflow.compile(checkpointer=checkpointer)
     return app
 
-# Create the compiled graph
-app = build_graph()
\ No newline at end of file
+# --- 7. Streaming ---
+
+# Nodes whose LLM tokens are surfaced while they generate
+STREAMING_NODES = ("writer", "critiquer")
+
+def _run_event(mode, payload):
+    """Converts a LangGraph stream item into ("token" | "update", node, data) events."""
+    if mode == "messages":
+        chunk, metadata = payload
+        node = metadata.get("langgraph_node")
+        if node in STREAMING_NODES and chunk.content:
+            return [("token", node, chunk.content)]
+        return []
+    
+    return [("update", node, output or {}) for node, output in payload.items()]
+
+# State fields whose updates are appended (operator.add) rather than replaced
+ADDITIVE_FIELDS = ("research_findings", "trace")
+
+def merge_update(state: dict, update: dict) -> dict:
+    """Applies a node update to a state in place, the way the graph's reducers do."""
+    for key, value in update.items():
+        if key in ADDITIVE_FIELDS:
+            state[key] = list(state.get(key) or []) + list(value or [])
+        else:
+            state[key] = value
+    return state
+
+def _track(events, state):
+    for event in events:
+        if state is not None and event[0] == "update":
+            merge_update(state, event[2])
+        yield event
+
+def iter_run_events(graph, inputs, config=None, state=None):
+    """Runs the graph, yielding node updates and the writer/critiquer tokens as they stream.
+    
+    If a state dict is given, every node update is merged into it, so it holds
+    the run's (compact) state once the events are exhausted.
+    """
+    for mode, payload in graph.stream(inputs, config=config, stream_mode=["updates", "messages"]):
+        yield from _track(_run_event(mode, payload), state)
+
+async def aiter_run_events(graph, inputs, config=None, state=None):
+    """Async counterpart of iter_run_events."""
+    async for mode, payload in graph.astream(inputs, config=config, stream_mode=["updates", "messages"]):
+        for event in _track(_run_event(mode, payload), state):
+            yield event
+
+# --- 8. Checkpointed Runs ---
+
+def create_checkpointer(path: str = CHECKPOINT_DB) -> SqliteSaver:
+    """Opens the SQLite checkpointer used for resumable runs."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+_checkpointed_app = None
+
+def get_checkpointed_app():
+    """Returns the sync graph compiled with the SQLite checkpointer, building it on first use."""
+    global _checkpointed_app
+    if _checkpointed_app is None:
+        _checkpointed_app = build_graph(checkpointer=create_checkpointer())
+    return _checkpointed_app
+
+def run_config(thread_id: str, **config) -> dict:
+    """Builds a graph config that checkpoints under the given run ID."""
+    return {**config, "configurable": {"thread_id": thread_id}}
+
+def get_run_state(graph, thread_id: str):
+    """Returns the last checkpointed snapshot of a run; snapshot.next lists the nodes still to run."""
+    return graph.get_state(run_config(thread_id))
+
+def resume_run_events(graph, thread_id: str, config=None):
+    """Continues a checkpointed run from its last completed node, yielding run events."""
+    yield from iter_run_events(graph, None, run_config(thread_id, **(config or {})))
+
+def list_runs(graph, limit: int = 20) -> List[str]:
+    """Lists checkpointed run IDs, most recent first."""
+    # Checkpoint IDs are time-ordered; one grouped query avoids deserializing every checkpoint
+    with graph.checkpointer.cursor(transaction=False) as cur:
+        cur.execute(
+            "SELECT thread_id FROM checkpoints GROUP BY thread_id ORDER BY MAX(checkpoint_id) DESC LIMIT ?",
+            (limit,)
+        )
+        return [row[0] for row in cur.fetchall()]
+
+def delete_run(graph, thread_id: str) -> int:
+    """Deletes a run's checkpoints, then the blobs no remaining checkpoint refers to.
+
+    Returns the number of blobs removed.
+    """
+    # This SqliteSaver version does not implement delete_thread
+    with graph.checkpointer.cursor() as cur:
+        cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        cur.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+    print(f"Deleted run {thread_id}")
+    return collect_garbage(graph.checkpointer)
+
+# --- 9. Compiled Graphs ---
+
+# Graphs are compiled on first use so importing this module stays cheap
+_apps = {}
+
+def get_app():
+    """Returns the compiled sync graph, building it on first use."""
+    if "sync" not in _apps:
+        _apps["sync"] = build_graph()
+    return _apps["sync"]
+
+def get_async_app():
+    """Returns the compiled async graph, building it on first use."""
+    if "async" not in _apps:
+        _apps["async"] = build_graph(use_async=True)
+    return _apps["async"]
+
+def __getattr__(name):
+    # Keeps `from graph import app` / `async_app` working without compiling at import
+    if name == "app":
+        return get_app()
+    if name == "async_app":
+        return get_async_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
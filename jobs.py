@@ -0,0 +1,122 @@
+# jobs.py
+
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 1. Settings ---
+
+# Research runs executed at the same time by one server process
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+
+# Finished jobs are kept this long so a refreshed page can still show them
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", "3600"))
+
+# --- 2. Jobs ---
+
+class Job:
+    """One research run executing in the background; collects its run events as they arrive."""
+
+    def __init__(self, session_id, topic, meta=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.topic = topic
+        self.meta = meta or {}
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._events = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in ("done", "error")
+
+    def append(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def events_since(self, cursor=0):
+        """Returns the events recorded after cursor and the cursor to poll from next."""
+        with self._lock:
+            events = self._events[cursor:]
+        return events, cursor + len(events)
+
+    def steps(self):
+        """Number of node updates recorded so far."""
+        with self._lock:
+            return sum(1 for kind, _, _ in self._events if kind == "update")
+
+# --- 3. Job Store ---
+
+class JobStore:
+    """Runs jobs on a worker pool and keeps them by ID and by the session that started them.
+
+    Jobs outlive the Streamlit script run that submitted them, so reruns and
+    page refreshes can attach to a run that is still in progress.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, retention=JOB_RETENTION_SECONDS):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="research-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, topic, run, finalize=None, meta=None):
+        """Queues a run and returns its Job.
+
+        run() returns an iterator of ("token" | "update", node, data) events.
+        finalize() returns the final state once the events are exhausted; by
+        default the last node update is used.
+        """
+        self._prune()
+        job = Job(session_id, topic, meta)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job, run, finalize)
+        return job
+
+    def _run(self, job, run, finalize):
+        job.status = "running"
+        last_update = None
+        try:
+            for event in run():
+                job.append(event)
+                if event[0] == "update":
+                    last_update = event[2]
+            job.result = finalize() if finalize else last_update
+            job.status = "done"
+        except Exception as e:
+            print(f"Job error on '{job.topic}': {e}")
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, session_id):
+        """Returns the session's jobs, most recent first."""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.session_id == session_id]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.done)
+
+    def _prune(self):
+        """Drops finished jobs older than the retention period."""
+        cutoff = time.time() - self.retention
+        with self._lock:
+            for job_id in [j.job_id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+                del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
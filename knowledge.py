@@ -0,0 +1,167 @@
+# knowledge.py
+
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from retrieval import tokenize
+
+# --- 1. Freshness Policies ---
+
+# Findings for ordinary queries are reused for a week
+KNOWLEDGE_MAX_AGE = int(os.environ.get("KNOWLEDGE_MAX_AGE", str(7 * 86400)))
+
+# Queries about fast-moving subjects only reuse findings from the last day
+KNOWLEDGE_VOLATILE_MAX_AGE = int(os.environ.get("KNOWLEDGE_VOLATILE_MAX_AGE", "86400"))
+
+VOLATILE_TERMS = frozenset("""
+latest news today current currently recent recently now price prices update updates upcoming week month
+""".split())
+
+_YEAR = re.compile(r"\b(19|20)\d\d\b")
+
+def max_age_for(query):
+    """Seconds a finding may be reused for query: short for time-sensitive queries, long otherwise."""
+    words = set(re.findall(r"\w+", query.lower()))
+    if words & VOLATILE_TERMS or _YEAR.search(query):
+        return KNOWLEDGE_VOLATILE_MAX_AGE
+    return KNOWLEDGE_MAX_AGE
+
+# --- 2. Knowledge Store ---
+
+class KnowledgeStore:
+    """Findings from past runs, with their sources, kept in SQLite and searchable with FTS5.
+
+    A stored finding is reused for a new query when it is fresh under the
+    policies of both queries, and the stored queries together cover at least
+    min_coverage of the new query's terms. The connection is opened on first
+    use so creating a store has no side effects.
+    """
+
+    def __init__(self, path, min_coverage=0.8, max_entries=5000, max_reused=3):
+        self.path = path
+        self.min_coverage = min_coverage
+        self.max_entries = max_entries
+        self.max_reused = max_reused
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS knowledge (
+                    id INTEGER PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )"""
+            )
+            # Full-text index over each finding's query and text; rowid matches knowledge.id
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(query, text)")
+            self._conn.commit()
+        return self._conn
+
+    def add(self, query, text, sources=()):
+        """Stores a finding for query with its source URLs."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                """INSERT INTO knowledge (query, text, sources, created_at, expires_at, used_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (query, text, json.dumps([s for s in sources if s]), now, now + max_age_for(query), now)
+            )
+            conn.execute("INSERT INTO knowledge_fts (rowid, query, text) VALUES (?, ?, ?)", (cursor.lastrowid, query, text))
+            self._prune(conn, now)
+            conn.commit()
+
+    def lookup(self, query, now=None):
+        """Returns stored findings that together answer query, best first, or [] if there is a gap.
+
+        Each entry is a dict with query, text, sources and created_at.
+        """
+        now = now or time.time()
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        max_age = max_age_for(query)
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                """SELECT k.id, k.query, k.text, k.sources, k.created_at
+                FROM knowledge_fts JOIN knowledge k ON k.id = knowledge_fts.rowid
+                WHERE knowledge_fts MATCH ? AND k.expires_at > ? AND k.created_at >= ?
+                ORDER BY bm25(knowledge_fts) LIMIT 20""",
+                (match, now, now - max_age)
+            ).fetchall()
+
+            # Greedily add stored findings whose queries cover the most of the remaining terms
+            chosen, covered = [], set()
+            candidates = [(row, terms & set(tokenize(row[1]))) for row in rows]
+            candidates = [(row, overlap) for row, overlap in candidates if len(overlap) >= len(terms) / 2]
+            while candidates and len(chosen) < self.max_reused and len(covered) < self.min_coverage * len(terms):
+                row, overlap = max(candidates, key=lambda c: len(c[1] - covered))
+                if not overlap - covered:
+                    break
+                chosen.append(row)
+                covered |= overlap
+                candidates.remove((row, overlap))
+
+            if not chosen or len(covered) < self.min_coverage * len(terms):
+                self.misses += 1
+                return []
+
+            conn.executemany("UPDATE knowledge SET used_at = ? WHERE id = ?", [(now, row[0]) for row in chosen])
+            conn.commit()
+            self.hits += 1
+
+        return [
+            {"query": row[1], "text": row[2], "sources": json.loads(row[3]), "created_at": row[4]}
+            for row in chosen
+        ]
+
+    def _prune(self, conn, now):
+        """Drops expired findings, then the least recently used ones over the size bound."""
+        stale = [row[0] for row in conn.execute("SELECT id FROM knowledge WHERE expires_at <= ?", (now,))]
+        count = conn.execute("SELECT COUNT(*) FROM knowledge").fetchone()[0] - len(stale)
+        if count > self.max_entries:
+            stale += [row[0] for row in conn.execute(
+                "SELECT id FROM knowledge WHERE expires_at > ? ORDER BY used_at ASC LIMIT ?",
+                (now, count - self.max_entries)
+            )]
+        if stale:
+            conn.executemany("DELETE FROM knowledge WHERE id = ?", [(i,) for i in stale])
+            conn.executemany("DELETE FROM knowledge_fts WHERE rowid = ?", [(i,) for i in stale])
+
+    def clear(self):
+        """Removes every stored finding."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM knowledge")
+            conn.execute("DELETE FROM knowledge_fts")
+            conn.commit()
+
+    def stats(self):
+        """Returns the number of stored findings and lookup counters."""
+        with self._lock:
+            count = self._connection().execute("SELECT COUNT(*) FROM knowledge").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "findings": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,259 @@
+# models.py
+
+import os
+import time
+import threading
+import weakref
+from collections import deque
+from clients import create_llm, running_loop, is_rate_limited, take_request_seconds, StreamInterrupted
+from tracing import record_call
+
+# --- 1. Settings ---
+
+SMALL_MODEL = os.environ.get("SMALL_MODEL", "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo")
+LARGE_MODEL = os.environ.get("LARGE_MODEL", "mistralai/Mixtral-8x7B-Instruct-v0.1")
+
+# Per-node model, output limit, temperature and fallback model. Each field can be
+# overridden with <NODE>_MODEL, <NODE>_MAX_TOKENS, <NODE>_TEMPERATURE, <NODE>_FALLBACK_MODEL
+# (e.g. WRITER_MODEL); an empty fallback disables it.
+DEFAULT_NODE_MODELS = {
+    "supervisor": {"model": SMALL_MODEL, "max_tokens": 256, "temperature": 0.0, "fallback": LARGE_MODEL},
+    "researcher": {"model": SMALL_MODEL, "max_tokens": 768, "temperature": 0.2, "fallback": LARGE_MODEL},
+    "digest": {"model": SMALL_MODEL, "max_tokens": 1536, "temperature": 0.2, "fallback": LARGE_MODEL},
+    "critique": {"model": SMALL_MODEL, "max_tokens": 1024, "temperature": 0.2, "fallback": LARGE_MODEL},
+    "writer": {"model": LARGE_MODEL, "max_tokens": 4096, "temperature": 0.3, "fallback": SMALL_MODEL},
+}
+
+# A model is switched to its node's fallback when, over its last MODEL_HEALTH_WINDOW
+# calls, the average latency or the error rate crosses these thresholds
+MODEL_HEALTH_WINDOW = int(os.environ.get("MODEL_HEALTH_WINDOW", "20"))
+MODEL_MIN_CALLS = int(os.environ.get("MODEL_MIN_CALLS", "3"))
+MODEL_MAX_ERROR_RATE = float(os.environ.get("MODEL_MAX_ERROR_RATE", "0.5"))
+MODEL_MAX_LATENCY = {
+    "supervisor": float(os.environ.get("SUPERVISOR_MAX_LATENCY", "10")),
+    "researcher": float(os.environ.get("RESEARCHER_MAX_LATENCY", "20")),
+    "digest": float(os.environ.get("DIGEST_MAX_LATENCY", "30")),
+    "critique": float(os.environ.get("CRITIQUE_MAX_LATENCY", "30")),
+    "writer": float(os.environ.get("WRITER_MAX_LATENCY", "120")),
+}
+
+# Seconds before a model that was switched away from is tried again
+MODEL_COOLDOWN = float(os.environ.get("MODEL_COOLDOWN", "300"))
+
+def node_settings(node):
+    """Model settings for a node: {"model", "max_tokens", "temperature", "fallback"}."""
+    defaults = DEFAULT_NODE_MODELS.get(node, DEFAULT_NODE_MODELS["writer"])
+    prefix = node.upper()
+    return {
+        "model": os.environ.get(f"{prefix}_MODEL", defaults["model"]),
+        "max_tokens": int(os.environ.get(f"{prefix}_MAX_TOKENS", defaults["max_tokens"])),
+        "temperature": float(os.environ.get(f"{prefix}_TEMPERATURE", defaults["temperature"])),
+        "fallback": os.environ.get(f"{prefix}_FALLBACK_MODEL", defaults["fallback"]) or None,
+    }
+
+# --- 2. Model Health ---
+
+class ModelHealth:
+    """Latency and outcome of a model's recent calls for one node."""
+
+    def __init__(self, window=MODEL_HEALTH_WINDOW):
+        self.calls = deque(maxlen=window)
+        self.tripped_at = None
+
+    def record(self, seconds, ok):
+        self.calls.append((seconds, ok))
+
+    def error_rate(self):
+        return sum(1 for _, ok in self.calls if not ok) / len(self.calls) if self.calls else 0.0
+
+    def avg_latency(self):
+        latencies = [seconds for seconds, ok in self.calls if ok]
+        return sum(latencies) / len(latencies) if latencies else 0.0
+
+    def degraded(self, max_latency, max_error_rate=MODEL_MAX_ERROR_RATE, min_calls=MODEL_MIN_CALLS):
+        """Whether enough recent calls were too slow or failed too often."""
+        if len(self.calls) < min_calls:
+            return False
+        return self.error_rate() > max_error_rate or (max_latency and self.avg_latency() > max_latency)
+
+# --- 3. Registry ---
+
+class ModelRegistry:
+    """Chooses the model for each node's LLM calls and tracks how those models perform.
+
+    A node uses its primary model until that model's recent latency or error
+    rate for the node crosses a threshold, then its fallback model. The
+    primary is tried again after the cooldown. Clients are created on first
+    use and shared by nodes with the same settings; each event loop gets its
+    own, since their async HTTP connections belong to the loop.
+    """
+
+    def __init__(self, cooldown=MODEL_COOLDOWN):
+        self.cooldown = cooldown
+        self.override = None
+        self._clients = {}
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def _client(self, model, max_tokens, temperature):
+        key = (model, max_tokens, temperature)
+        loop = running_loop()
+        with self._lock:
+            clients = self._clients if loop is None else self._loop_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = create_llm(
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    together_api_key=os.environ.get("TOGETHER_API_KEY")
+                )
+            return clients[key]
+
+    def _health_of(self, node, model):
+        with self._lock:
+            return self._health.setdefault((node, model), ModelHealth())
+
+    def current(self, node):
+        """The model choose() would return for a node, without changing any health or fallback state."""
+        settings = node_settings(node)
+        primary, fallback = settings["model"], settings["fallback"]
+        if not fallback or fallback == primary:
+            return primary
+
+        with self._lock:
+            health = self._health.get((node, primary))
+            if health is None:
+                return primary
+            if health.tripped_at is not None:
+                return fallback if time.monotonic() - health.tripped_at < self.cooldown else primary
+            return fallback if health.degraded(MODEL_MAX_LATENCY.get(node)) else primary
+
+    def choose(self, node):
+        """Returns the model name a node's next call should use."""
+        settings = node_settings(node)
+        primary, fallback = settings["model"], settings["fallback"]
+        if not fallback or fallback == primary:
+            return primary
+
+        health = self._health_of(node, primary)
+        with self._lock:
+            if health.tripped_at is not None:
+                if time.monotonic() - health.tripped_at < self.cooldown:
+                    return fallback
+                # Cooldown over: give the primary a fresh window
+                health.tripped_at = None
+                health.calls.clear()
+                print(f"Models: {node} back on {primary}")
+            elif health.degraded(MODEL_MAX_LATENCY.get(node)):
+                health.tripped_at = time.monotonic()
+                print(f"Models: {node} switching from {primary} to {fallback} "
+                      f"(avg {health.avg_latency():.1f}s, {health.error_rate():.0%} errors)")
+                return fallback
+        return primary
+
+    def fallback_for(self, node, model):
+        """The alternate model to retry a failed call with, or None."""
+        settings = node_settings(node)
+        for candidate in (settings["fallback"], settings["model"]):
+            if candidate and candidate != model:
+                return candidate
+        return None
+
+    def llm(self, node, model=None):
+        """Returns the client for a node, on model if given, else on the node's current choice."""
+        if self.override is not None:
+            return self.override
+        settings = node_settings(node)
+        return self._client(model or self.choose(node), settings["max_tokens"], settings["temperature"])
+
+    def peek(self, node):
+        """Returns the client a node's next call would use, without changing any health or fallback state."""
+        if self.override is not None:
+            return self.override
+        settings = node_settings(node)
+        return self._client(self.current(node), settings["max_tokens"], settings["temperature"])
+
+    def record(self, node, model, seconds, ok=True):
+        """Records the latency and outcome of a node's call on a model."""
+        self._health_of(node, model).record(seconds, ok)
+
+    def _model_seconds(self, start):
+        """A call's time on the model itself: its last request, without rate-limit waits or backoff."""
+        seconds = take_request_seconds()
+        return seconds if seconds is not None else time.monotonic() - start
+
+    def _record_failure(self, node, model, start, error):
+        # Rate limits are the provider's, not the model's; they do not count toward its error rate
+        seconds = self._model_seconds(start)
+        if not is_rate_limited(error):
+            self.record(node, model, seconds, ok=False)
+
+    def _retry_model(self, node, model, error):
+        """Returns the model to retry a failed call on, or None to give up."""
+        # Its chunks already reached stream listeners; a retry would repeat them
+        if isinstance(error, StreamInterrupted):
+            return None
+        fallback = self.fallback_for(node, model)
+        if fallback:
+            print(f"Models: {node} call on {model} failed ({error}), retrying on {fallback}")
+            record_call("fallback")
+        return fallback
+
+    def call(self, node, fn):
+        """Runs fn(llm) on the node's current model, retrying once on the alternate model if it fails."""
+        if self.override is not None:
+            return fn(self.override)
+
+        model = self.choose(node)
+        for attempt in range(2):
+            take_request_seconds()  # drops the time of a request made before this call
+            start = time.monotonic()
+            try:
+                response = fn(self.llm(node, model))
+            except Exception as e:
+                self._record_failure(node, model, start, e)
+                fallback = self._retry_model(node, model, e) if attempt == 0 else None
+                if not fallback:
+                    raise
+                model = fallback
+                continue
+            self.record(node, model, self._model_seconds(start))
+            return response
+
+    async def acall(self, node, fn):
+        """Async counterpart of call; fn(llm) returns an awaitable."""
+        if self.override is not None:
+            return await fn(self.override)
+
+        model = self.choose(node)
+        for attempt in range(2):
+            take_request_seconds()  # drops the time of a request made before this call
+            start = time.monotonic()
+            try:
+                response = await fn(self.llm(node, model))
+            except Exception as e:
+                self._record_failure(node, model, start, e)
+                fallback = self._retry_model(node, model, e) if attempt == 0 else None
+                if not fallback:
+                    raise
+                model = fallback
+                continue
+            self.record(node, model, self._model_seconds(start))
+            return response
+
+    def metrics(self):
+        """Per node and model: calls in the window, error rate, average latency and whether it is switched off."""
+        with self._lock:
+            items = list(self._health.items())
+        return {
+            f"{node}:{model}": {
+                "calls": len(health.calls),
+                "error_rate": health.error_rate(),
+                "avg_seconds": health.avg_latency(),
+                "on_fallback": health.tripped_at is not None,
+            }
+            for (node, model), health in items
+        }
+
+registry = ModelRegistry()
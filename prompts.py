@@ -21,10 +21,10 @@ Here is the current project state:
 ---
 Main Topic: {main_task}
 
-Research Findings:
+Research Findings ({findings_count} gathered; most relevant excerpts):
 {research_findings}
 
-Draft:
+Draft Outline:
 {draft}
 
 Critique Notes:
@@ -36,10 +36,12 @@ Revision Number: {revision_number}
 Based on this state, provide your decision in the following JSON format:
 {{
     "next_step": "researcher" or "writer" or "END",
-    "task_description": "Clear task for the next agent"
+    "task_description": "Clear task for the next agent",
+    "sub_tasks": ["Specific search query 1", "Specific search query 2"]
 }}
 
-If you decide "researcher", provide a concise and specific research sub-task.
+If you decide "researcher", provide a concise and specific research sub-task, and split it into
+at most {max_sub_tasks} independent search queries in "sub_tasks". They will be researched in parallel.
 If you decide "writer", provide instructions (e.g., "Write the first draft" or "Revise based on critique").
 If you decide "END", state "The report is complete."
 
@@ -87,6 +89,111 @@ Instructions:
 Generate the report now:
 """
 
+# ------------------------- #
+# MAP-REDUCE WRITER PROMPTS #
+# ------------------------- #
+
+outline_prompt_template = """
+You are a professional report Writer. Your job is to plan the structure of a research report.
+
+Main Research Topic: {main_task}
+
+Numbered Research Findings (excerpts):
+{findings}
+
+Critique Notes:
+{critique_notes}
+
+Plan the body sections of the report (at most {max_sections}). For each section give a heading,
+one sentence on what it covers, and the numbers of the findings it should draw on.
+Do not plan an introduction or a conclusion; they are written separately.
+
+Respond ONLY with valid JSON in the following format, no other text:
+{{
+    "title": "Report title",
+    "sections": [
+        {{"heading": "Section heading", "focus": "What the section covers", "findings": [1, 2]}}
+    ]
+}}
+"""
+
+section_writer_prompt_template = """
+You are a professional report Writer. Your job is to write one section of a research report.
+
+Main Research Topic: {main_task}
+
+Report Outline:
+{outline}
+
+Section to Write: {heading}
+Section Focus: {focus}
+
+Relevant Research Findings:
+{research_findings}
+
+Critique Notes:
+{critique_notes}
+
+Instructions:
+1. Write only this section, starting with the heading line "## {heading}".
+2. Cover the section focus in depth; the other sections are written separately, so do not repeat them.
+3. Do not include information not present in the research findings.
+
+Generate the section now:
+"""
+
+report_merge_prompt_template = """
+You are a professional report Writer. The body sections of a research report were written
+separately; your job is to frame them into one coherent report.
+
+Main Research Topic: {main_task}
+
+Report Title: {title}
+
+Report Sections (headings and opening sentences):
+{sections}
+
+Write an introduction that presents the topic and leads into the sections in order, and a
+conclusion that ties their findings together. Keep each to one or two paragraphs.
+
+Use exactly this format:
+## Introduction
+(introduction)
+
+## Conclusion
+(conclusion)
+"""
+
+# ------------------------- #
+# SECTION REVISION PROMPT   #
+# ------------------------- #
+
+section_revision_prompt_template = """
+You are a professional report Writer. Your job is to revise selected sections of an existing report.
+
+Main Research Topic: {main_task}
+
+Research Findings:
+{research_findings}
+
+Report Outline:
+{outline}
+
+Sections to Revise:
+{sections}
+
+Critique Notes:
+{critique_notes}
+
+Instructions:
+1. Rewrite ONLY the sections shown under "Sections to Revise", addressing the critique points about them.
+2. Start each section with its original heading line, unchanged, and keep them in the same order.
+3. Do not output any other part of the report; the remaining sections are kept as they are.
+4. Do not include information not present in the research findings.
+
+Generate the revised sections now:
+"""
+
 # ----------------- #
 # CRITIQUE PROMPT   #
 # ----------------- #
@@ -100,6 +207,9 @@ Main Research Topic: {main_task}
 Research Draft to Review:
 {draft}
 
+Sections of the Draft:
+{sections}
+
 Provide your critique. Be specific:
 - Does the draft address the main topic?
 - Is the information accurate and well-supported?
@@ -107,7 +217,66 @@ Provide your critique. Be specific:
 - Are there any missing pieces of information?
 
 **If the draft is good and requires no further revisions, respond with ONLY the word "APPROVED".**
-Otherwise, provide clear, actionable feedback for the writer.
+Otherwise, provide clear, actionable feedback for the writer. Start each point with the section
+it concerns, e.g. "[Section 2]", or with "[General]" if it concerns the report as a whole.
 
 Critique:
-"""
\ No newline at end of file
+"""
+
+# ----------------- #
+# REVIEWER PROMPT   #
+# ----------------- #
+
+# Fused critique and routing: one call reviews the draft and picks the next step
+reviewer_prompt_template = """
+You are a professional Reviewer Agent. Review a research draft for quality, accuracy, and
+completeness, and decide what the team does next.
+
+Main Research Topic: {main_task}
+
+Research Findings Gathered So Far: {findings_count}
+
+Research Draft to Review:
+{draft}
+
+Sections of the Draft:
+{sections}
+
+Check whether the draft addresses the main topic, whether the information is accurate and
+well-supported, whether it is well-structured, and whether information is missing.
+
+Then choose the next step:
+1. **"END"**: The draft is good and needs no further revisions.
+2. **"writer"**: The draft can be fixed from the research already gathered.
+3. **"researcher"**: The draft is missing facts that need new searches.
+
+Respond with your review in the following JSON format:
+{{
+    "verdict": "approved" or "revise",
+    "feedback": "Clear, actionable feedback for the writer",
+    "next_step": "END" or "writer" or "researcher",
+    "research_queries": ["Specific search query 1", "Specific search query 2"]
+}}
+
+Start each feedback point with the section it concerns, e.g. "[Section 2]", or with "[General]"
+if it concerns the report as a whole. Give at most {max_sub_tasks} independent search queries,
+and only when the next step is "researcher".
+
+Respond ONLY with valid JSON, no other text.
+"""
+
+# ----------------- #
+# DIGEST PROMPT     #
+# ----------------- #
+
+digest_prompt_template = """
+You maintain a running digest of research findings for the topic: {main_task}
+
+Merge the material below into one compact digest of at most {max_words} words.
+Keep every distinct fact, figure and source; drop repetition and filler.
+
+Material:
+{findings}
+
+Digest:
+"""
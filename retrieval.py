@@ -0,0 +1,271 @@
+# retrieval.py
+
+import os
+import re
+import math
+import hashlib
+import functools
+from collections import Counter, defaultdict
+from digest import estimate_tokens
+
+# --- 1. Settings ---
+
+# Build prompts from the passages most relevant to the task instead of every finding
+RETRIEVAL_ENABLED = os.environ.get("RETRIEVAL_ENABLED", "1") == "1"
+
+# Passages retrieved per prompt (token budgets still apply) and words per passage
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "24"))
+RETRIEVAL_CHUNK_WORDS = int(os.environ.get("RETRIEVAL_CHUNK_WORDS", "80"))
+
+# Estimated shingle Jaccard similarity above which a passage counts as a duplicate
+RETRIEVAL_DEDUP_THRESHOLD = float(os.environ.get("RETRIEVAL_DEDUP_THRESHOLD", "0.8"))
+
+# Token budget of the search evidence sent to the researcher's summarization call
+EVIDENCE_TOKEN_BUDGET = int(os.environ.get("EVIDENCE_TOKEN_BUDGET", "400"))
+
+# Longest page text considered per search result when raw content is requested
+MAX_RESULT_CHARS = 20000
+
+# MinHash signature: NUM_PERM hashes split into BANDS locality-sensitive bands
+SHINGLE_WORDS = 4
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_WORD = re.compile(r"\w+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+""".split())
+
+def tokenize(text):
+    """Lowercased words without stopwords, as indexed by BM25."""
+    return [w for w in _WORD.findall(text.lower()) if w not in STOPWORDS]
+
+# --- 2. Chunking ---
+
+def split_units(text, max_words=RETRIEVAL_CHUNK_WORDS):
+    """Splits a finding into its lines (e.g. bullets), cutting lines much longer than max_words at sentences."""
+    units = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if len(line.split()) > 2 * max_words:
+            units.extend(s.strip() for s in _SENTENCE.split(line) if s.strip())
+        else:
+            units.append(line)
+    return units
+
+def group_units(units, max_words=RETRIEVAL_CHUNK_WORDS):
+    """Packs consecutive units into passages of about max_words."""
+    passages, current, count = [], [], 0
+    for unit in units:
+        words = len(unit.split())
+        if current and count + words > max_words:
+            passages.append("\n".join(current))
+            current, count = [], 0
+        current.append(unit)
+        count += words
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+# --- 3. Near-Duplicate Detection ---
+
+_PRIME = (1 << 61) - 1
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+# Fixed (a, b) pairs for the universal hash family, so signatures are stable across runs
+_PERMUTATIONS = [
+    (_hash64(f"a{i}") % (_PRIME - 1) + 1, _hash64(f"b{i}") % _PRIME) for i in range(NUM_PERM)
+]
+
+@functools.lru_cache(maxsize=4096)
+def minhash(text):
+    """MinHash signature of a passage's word shingles, or None for a passage without words."""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    shingles = {
+        _hash64(" ".join(words[i:i + SHINGLE_WORDS]))
+        for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    return tuple(min((a * h + b) % _PRIME for h in shingles) for a, b in _PERMUTATIONS)
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(signature_a, signature_b)) / NUM_PERM
+
+class Deduplicator:
+    """Remembers MinHash signatures and flags texts that nearly duplicate one seen before.
+
+    Only texts sharing an LSH band are compared, so the cost stays close to
+    linear in the number of texts.
+    """
+
+    def __init__(self, threshold=RETRIEVAL_DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.signatures = []
+        self.buckets = defaultdict(list)
+
+    def add(self, text):
+        """Records text and returns True, or returns False if it is a near-duplicate (or has no words)."""
+        signature = minhash(text)
+        if signature is None:
+            return False
+
+        bands = [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+        candidates = {i for key in bands for i in self.buckets[key]}
+        if any(similarity(signature, self.signatures[i]) >= self.threshold for i in candidates):
+            return False
+
+        for key in bands:
+            self.buckets[key].append(len(self.signatures))
+        self.signatures.append(signature)
+        return True
+
+def deduplicate(texts, threshold=RETRIEVAL_DEDUP_THRESHOLD):
+    """Drops texts that nearly duplicate an earlier one, keeping the first occurrence."""
+    seen = Deduplicator(threshold)
+    return [text for text in texts if seen.add(text)]
+
+# --- 4. Ranking ---
+
+class BM25:
+    """Okapi BM25 ranking over a fixed list of documents."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms = [Counter(tokenize(doc)) for doc in documents]
+        self.lengths = [sum(terms.values()) for terms in self.terms]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.doc_freq = Counter(term for terms in self.terms for term in terms)
+
+    def idf(self, term):
+        n, df = len(self.terms), self.doc_freq.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def scores(self, query):
+        """BM25 score of every document for a query."""
+        query_terms = set(tokenize(query))
+        scores = []
+        for terms, length in zip(self.terms, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            scores.append(sum(
+                self.idf(t) * terms[t] * (self.k1 + 1) / (terms[t] + norm)
+                for t in query_terms if t in terms
+            ))
+        return scores
+
+# --- 5. Findings Index ---
+
+class FindingsIndex:
+    """Chunked, deduplicated passages of a run's research findings, searchable with BM25."""
+
+    def __init__(self, findings):
+        # Duplicates are dropped line by line, then each finding's remaining lines become passages
+        seen = Deduplicator()
+        self.passages, self.duplicates = [], 0
+        for finding in findings:
+            units = split_units(finding)
+            kept = [unit for unit in units if seen.add(unit)]
+            self.duplicates += len(units) - len(kept)
+            self.passages.extend(group_units(kept))
+        self.bm25 = BM25(self.passages)
+
+    def search(self, query, k=RETRIEVAL_TOP_K, budget=None):
+        """Returns up to k passages ranked for query and fitting the token budget, in source order."""
+        scores = self.bm25.scores(query)
+        # Stable sort: passages that tie (e.g. no query term matched) keep their original order
+        ranked = sorted(range(len(self.passages)), key=lambda i: -scores[i])
+
+        chosen, used = [], 0
+        for i in ranked:
+            if len(chosen) >= k:
+                break
+            tokens = estimate_tokens(self.passages[i])
+            if budget is not None and used + tokens > budget:
+                continue
+            chosen.append(i)
+            used += tokens
+        return [self.passages[i] for i in sorted(chosen)]
+
+    def context(self, query, k=RETRIEVAL_TOP_K, budget=None):
+        """search() joined into prompt text."""
+        return "\n\n".join(self.search(query, k, budget))
+
+@functools.lru_cache(maxsize=32)
+def _cached_index(findings):
+    return FindingsIndex(findings)
+
+def index_for(findings):
+    """Returns the index over a run's findings, reusing it while the findings are unchanged."""
+    return _cached_index(tuple(findings))
+
+# --- 6. Extractive Compression of Search Results ---
+
+def _sentences(text, max_words=60):
+    """Splits text into sentences, dropping fragments and cutting run-on sentences."""
+    sentences = []
+    for sentence in _SENTENCE.split(" ".join(text[:MAX_RESULT_CHARS].split())):
+        words = sentence.split()
+        if len(words) < 4:
+            continue
+        sentences.append(" ".join(words[:max_words]) + (" ..." if len(words) > max_words else ""))
+    return sentences
+
+def compress_results(query, results, budget=EVIDENCE_TOKEN_BUDGET):
+    """Selects the sentences of all search results most relevant to query, within a token budget.
+
+    Uses a result's raw_content when present, otherwise its content snippet.
+    Near-duplicate sentences are dropped and the rest ranked with BM25.
+    Each result contributes its best sentence first (so no source is
+    dropped outright), then the budget is filled with the remaining
+    sentences that match the query, best first. Returns the
+    evidence grouped per source, sentences in their original order.
+    """
+    seen = Deduplicator()
+    candidates = []  # (result index, sentence index, sentence)
+    for r, result in enumerate(results):
+        text = result.get("raw_content") or result.get("content") or ""
+        for i, sentence in enumerate(_sentences(text)):
+            if seen.add(sentence):
+                candidates.append((r, i, sentence))
+
+    scores = BM25([c[2] for c in candidates]).scores(query)
+    # Ties keep search rank and page order, so the leading sentences of top results win
+    ranked = sorted(range(len(candidates)), key=lambda c: -scores[c])
+
+    best_per_result = {}
+    for c in ranked:
+        best_per_result.setdefault(candidates[c][0], c)
+    leads = set(best_per_result.values())
+    order = list(best_per_result.values()) + [c for c in ranked if c not in leads and scores[c] > 0]
+
+    # Each source costs its title and URL line once
+    headers = {
+        r: f"**{result.get('title', 'Untitled')}**\nSource: {result.get('url', 'N/A')}"
+        for r, result in enumerate(results)
+    }
+
+    chosen, covered, used = set(), set(), 0
+    for c in order:
+        r = candidates[c][0]
+        cost = estimate_tokens(candidates[c][2]) + (0 if r in covered else estimate_tokens(headers[r]))
+        if used + cost > budget:
+            continue
+        chosen.add(c)
+        covered.add(r)
+        used += cost
+
+    blocks = []
+    for r in range(len(results)):
+        sentences = [candidates[c][2] for c in sorted(chosen) if candidates[c][0] == r]
+        if sentences:
+            blocks.append(headers[r] + "\n" + " ".join(sentences))
+    return "\n---\n".join(blocks)
@@ -0,0 +1,176 @@
+# sections.py
+
+import os
+import re
+import json
+
+# --- 1. Settings ---
+
+# Rewrite only the sections a critique concerns instead of regenerating the whole report
+SECTION_REVISIONS = os.environ.get("SECTION_REVISIONS", "1") == "1"
+
+# Above this share of affected sections the writer regenerates the whole report
+SECTION_REVISION_MAX_FRACTION = float(os.environ.get("SECTION_REVISION_MAX_FRACTION", "0.6"))
+
+# Writing mode for full drafts: "single" (one LLM call) or "map_reduce" (outline, parallel sections, merge)
+WRITER_MODE = os.environ.get("WRITER_MODE", "single")
+
+# Upper bound on body sections planned by the map-reduce writer
+MAX_REPORT_SECTIONS = int(os.environ.get("MAX_REPORT_SECTIONS", "6"))
+
+# Top-level (#) and section (##) headings split a draft; deeper headings stay inside their section
+_HEADING = re.compile(r"^#{1,2}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+
+# --- 2. Splitting and Splicing ---
+
+def _normalize(title):
+    return " ".join(re.sub(r"[^\w\s]", " ", title.lower()).split())
+
+def split_sections(draft):
+    """Splits a markdown draft into [{"title", "text"}] at # and ## headings.
+
+    Text before the first heading becomes a section with an empty title.
+    Joining the texts with blank lines reproduces the draft.
+    """
+    if not draft or not draft.strip():
+        return []
+
+    matches = list(_HEADING.finditer(draft))
+    sections = []
+
+    preamble = draft[:matches[0].start()] if matches else draft
+    if preamble.strip():
+        sections.append({"title": "", "text": preamble.strip()})
+
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(draft)
+        sections.append({"title": match.group(1).strip(), "text": draft[match.start():end].strip()})
+    return sections
+
+def join_sections(sections):
+    """Reassembles sections into a draft."""
+    return "\n\n".join(section["text"] for section in sections)
+
+def section_outline(sections):
+    """Numbered list of section titles, as referenced by the critique."""
+    return "\n".join(
+        f"{i}. {section['title'] or '(Introduction)'}" for i, section in enumerate(sections, 1)
+    )
+
+def splice_sections(sections, revised_text, indices):
+    """Replaces the sections at indices with their rewritten versions from revised_text.
+
+    Rewritten sections are matched by heading; a section missing from the
+    rewrite keeps its old text. Returns None if nothing could be matched.
+    """
+    rewritten = {_normalize(s["title"]): s["text"] for s in split_sections(revised_text) if s["title"]}
+
+    spliced = [dict(section) for section in sections]
+    matched = 0
+    for i in indices:
+        text = rewritten.get(_normalize(sections[i]["title"]))
+        if text:
+            spliced[i]["text"] = text
+            matched += 1
+
+    return spliced if matched else None
+
+def changed_sections(old_draft, new_draft):
+    """Titles of the sections of new_draft that are new or differ from old_draft."""
+    old = {_normalize(s["title"]): s["text"] for s in split_sections(old_draft)}
+    return [
+        s["title"] or "(Introduction)"
+        for s in split_sections(new_draft)
+        if old.get(_normalize(s["title"])) != s["text"]
+    ]
+
+def sections_text(draft, titles):
+    """Joined text of the sections of draft with the given titles (as returned by changed_sections)."""
+    wanted = {"" if title == "(Introduction)" else _normalize(title) for title in titles}
+    return join_sections([s for s in split_sections(draft) if _normalize(s["title"]) in wanted])
+
+def with_heading(text, heading):
+    """Makes sure a generated section starts with its ## heading."""
+    text = text.strip()
+    if _HEADING.match(text.split("\n", 1)[0]):
+        return text
+    return f"## {heading}\n\n{text}"
+
+# --- 3. Map-Reduce Outlines ---
+
+def parse_outline(content, findings_count, max_sections=MAX_REPORT_SECTIONS):
+    """Parses the planner's JSON outline into {"title", "sections": [{"heading", "focus", "findings"}]}.
+
+    Finding numbers are converted to 0-based indices and out-of-range numbers
+    dropped. Raises ValueError if no usable section was planned.
+    """
+    text = content.strip()
+    # Remove markdown code blocks if present
+    if text.startswith("```"):
+        text = "\n".join(l for l in text.split("\n") if not l.strip().startswith("```"))
+
+    outline = json.loads(text.strip())
+    sections = []
+    for section in outline.get("sections") or []:
+        if not isinstance(section, dict) or not str(section.get("heading", "")).strip():
+            continue
+        findings = []
+        for number in section.get("findings") or []:
+            try:
+                index = int(number) - 1
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < findings_count and index not in findings:
+                findings.append(index)
+        sections.append({
+            "heading": str(section["heading"]).strip().lstrip("#").strip(),
+            "focus": str(section.get("focus", "")).strip(),
+            "findings": findings
+        })
+
+    if not sections:
+        raise ValueError("Outline has no sections")
+    return {"title": str(outline.get("title") or "").strip(), "sections": sections[:max_sections]}
+
+def assemble_report(title, section_texts, framing=""):
+    """Joins independently written sections, placing the framing's Introduction and Conclusion around them."""
+    framing_sections = {_normalize(s["title"]): s["text"] for s in split_sections(framing) if s["title"]}
+    parts = [f"# {title}"] if title else []
+    if "introduction" in framing_sections:
+        parts.append(framing_sections["introduction"])
+    parts += [text.strip() for text in section_texts]
+    if "conclusion" in framing_sections:
+        parts.append(framing_sections["conclusion"])
+    return "\n\n".join(parts)
+
+# --- 4. Mapping Critiques to Sections ---
+
+_SECTION_TAG = re.compile(r"\[\s*section\s+(\d+)\s*\]", re.IGNORECASE)
+_GENERAL_TAG = re.compile(r"\[\s*general\s*\]", re.IGNORECASE)
+
+def sections_for_critique(critique, sections):
+    """Returns the sorted indices of the sections a critique concerns.
+
+    Uses the critique's [Section N] tags, falling back to section titles
+    mentioned in the text. Returns None when the critique concerns the whole
+    report ([General], nothing mapped, or too many sections affected).
+    """
+    if len(sections) < 2 or not critique or _GENERAL_TAG.search(critique):
+        return None
+
+    indices = {int(n) - 1 for n in _SECTION_TAG.findall(critique)}
+    indices = {i for i in indices if 0 <= i < len(sections)}
+
+    if not indices:
+        text = _normalize(critique)
+        for i, section in enumerate(sections):
+            title = _normalize(section["title"])
+            if len(title) > 3 and re.search(rf"\b{re.escape(title)}\b", text):
+                indices.add(i)
+
+    # A rewritten introduction has no heading to splice it back by
+    if not indices or any(not sections[i]["title"] for i in indices):
+        return None
+    if len(indices) > SECTION_REVISION_MAX_FRACTION * len(sections):
+        return None
+    return sorted(indices)
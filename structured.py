@@ -0,0 +1,180 @@
+# structured.py
+
+import os
+import json
+
+# --- 1. Settings ---
+
+# Output cap for the map-reduce outline (the supervisor's cap is its node setting in models.py)
+OUTLINE_MAX_TOKENS = int(os.environ.get("OUTLINE_MAX_TOKENS", "512"))
+
+# --- 2. Schemas ---
+
+# A small subset of JSON Schema: type (name or list), enum, required, properties, items
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+SUPERVISOR_SCHEMA = {
+    "type": "object",
+    "required": ["next_step"],
+    "properties": {
+        "next_step": {"type": "string", "enum": ["researcher", "writer", "END"]},
+        "task_description": {"type": "string"},
+        "sub_tasks": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+REVIEW_SCHEMA = {
+    "type": "object",
+    "required": ["next_step"],
+    "properties": {
+        "verdict": {"type": "string", "enum": ["approved", "revise"]},
+        "feedback": {"type": "string"},
+        "next_step": {"type": "string", "enum": ["END", "writer", "researcher"]},
+        "research_queries": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "required": ["sections"],
+    "properties": {
+        "title": {"type": "string"},
+        "sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["heading"],
+                "properties": {
+                    "heading": {"type": "string"},
+                    "focus": {"type": "string"},
+                    "findings": {"type": "array", "items": {"type": ["integer", "string"]}},
+                },
+            },
+        },
+    },
+}
+
+class SchemaError(ValueError):
+    """Raised when a parsed object does not match its schema."""
+
+def validate(value, schema, path="$"):
+    """Checks value against a schema, raising SchemaError at the first mismatch."""
+    types = schema.get("type")
+    if types:
+        names = types if isinstance(types, list) else [types]
+        # bool is an int subclass; only accept it where "boolean" is allowed
+        if isinstance(value, bool) and "boolean" not in names:
+            raise SchemaError(f"{path}: expected {' or '.join(names)}, got boolean")
+        if not any(isinstance(value, _TYPES[name]) for name in names):
+            raise SchemaError(f"{path}: expected {' or '.join(names)}, got {type(value).__name__}")
+
+    if "enum" in schema and value not in schema["enum"]:
+        raise SchemaError(f"{path}: {value!r} is not one of {schema['enum']}")
+
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                raise SchemaError(f"{path}: missing required field {key!r}")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                validate(value[key], subschema, f"{path}.{key}")
+
+    if isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            validate(item, schema["items"], f"{path}[{i}]")
+
+# --- 3. Incremental Parsing ---
+
+class JSONObjectScanner:
+    """Finds complete top-level JSON objects in text that arrives in pieces.
+
+    Tracks brace depth outside of strings, so text around the object (code
+    fences, a preamble, trailing commentary) is skipped.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.current = []
+
+    def feed(self, text):
+        """Consumes text and returns the objects (as text) completed by it."""
+        completed = []
+        for char in text:
+            if self.depth == 0:
+                if char == "{":
+                    self.depth, self.current = 1, [char]
+                continue
+
+            self.current.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    completed.append("".join(self.current))
+                    self.current = []
+        return completed
+
+class StructuredStream:
+    """Collects a streamed completion until it contains a JSON object that matches a schema.
+
+    feed() returns the object once one is complete and valid, so the caller
+    can stop generating; invalid objects are skipped in favour of a later one.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.scanner = JSONObjectScanner()
+        self.chunks = []
+        self.result = None
+        self.result_text = None
+        self.error = None
+
+    @property
+    def text(self):
+        """Everything received so far."""
+        return "".join(self.chunks)
+
+    def feed(self, text):
+        if self.result is not None:
+            return self.result
+        self.chunks.append(text)
+        for candidate in self.scanner.feed(text):
+            try:
+                value = json.loads(candidate)
+                if self.schema:
+                    validate(value, self.schema)
+            except ValueError as e:
+                self.error = e
+                continue
+            self.result, self.result_text = value, candidate
+            return value
+        return None
+
+    def output(self):
+        """The valid object's JSON text, or all the text received when there is none."""
+        return self.result_text if self.result is not None else self.text
+
+def parse_structured(text, schema=None):
+    """Non-streaming counterpart: the first schema-valid object in text, as JSON text, or text unchanged."""
+    stream = StructuredStream(schema)
+    stream.feed(text)
+    return stream.output()
@@ -0,0 +1,49 @@
+import pytest
+
+# benchmark points the caches at a temporary directory, so it is imported first
+from benchmark import FakeLLM, FakeSearchTool, Scenario, _words
+import agents
+import graph
+from cache import CachedSearchTool
+
+class ExpandingLLM(FakeLLM):
+    """Section revisions come back expanded, as a real writer's would."""
+
+    def _respond(self, prompt):
+        text = super()._respond(prompt)
+        if "Sections to Revise" in prompt:
+            text += "\n" + _words("expanded", 100)
+        return text
+
+def _run(review_mode):
+    llm = ExpandingLLM(Scenario("one_section", revisions=2), latency=0, writer_words=2400)
+    agents.configure(llm=llm, search_tool=CachedSearchTool(FakeSearchTool(latency=0), agents.search_cache))
+    agents.search_cache.clear()
+    agents.llm_cache.clear()
+    agents.knowledge.clear()
+    state = graph.get_app().invoke(
+        graph.initial_state("Convergence topic", "single", review_mode=review_mode),
+        {"recursion_limit": 50}
+    )
+    return llm, state
+
+def test_expanded_section_is_not_converged():
+    old = "# Report\n\n" + "\n\n".join(f"## Part {i}\n{_words(f'p{i}w', 400)}" for i in range(1, 7))
+    new = old.replace(f"## Part 3\n{_words('p3w', 400)}", f"## Part 3\n{_words('p3w', 400)} {_words('more', 100)}")
+    # The whole report barely changes, the revised section does
+    assert graph.draft_similarity(old, new) >= graph.DRAFT_CONVERGENCE_THRESHOLD
+
+    update = graph._write_update({"draft": old, "revision_number": 1}, new)
+    assert update["revised_sections"] == ["Part 3"]
+    assert "termination_reason" not in update
+    assert update["convergence"]["draft_similarity"] < graph.DRAFT_CONVERGENCE_THRESHOLD
+
+@pytest.mark.parametrize("review_mode", ["fused", "separate"])
+def test_section_revision_reaches_reviewer(review_mode):
+    llm, state = _run(review_mode)
+    kind = "review" if review_mode == "fused" else "critique"
+
+    assert state["revised_sections"] == ["Section 1"]
+    assert len(llm.prompt_chars[kind]) == 2
+    assert state["critique_notes"] == "APPROVED"
+    assert not state["termination_reason"].startswith("Converged")
@@ -0,0 +1,244 @@
+# tracing.py
+
+import json
+import time
+import uuid
+import functools
+import contextvars
+import inspect
+
+# Span of the graph node currently executing in this thread or task
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# --- 1. Spans ---
+
+class Span:
+    """Timing, token and cache measurements for one graph node execution."""
+
+    def __init__(self, name):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = 0.0
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.prompt_chars = 0
+        self.timings = {}
+        self.calls = {}
+        self.cache = {}
+        self.saved = {}
+        self.providers = {}
+        self.errors = []
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        return self
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration": round(self.duration, 4),
+            "llm_calls": self.llm_calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "prompt_chars": self.prompt_chars,
+            "timings": {k: round(v, 4) for k, v in self.timings.items()},
+            "calls": self.calls,
+            "cache": self.cache,
+            "saved": self.saved,
+            "providers": self.providers,
+            "errors": self.errors,
+        }
+
+# --- 2. Recording ---
+
+def current_span():
+    """Returns the span of the running node, or None outside a traced node."""
+    return _current_span.get()
+
+def record_llm(prompt_chars, input_tokens=0, output_tokens=0, seconds=0.0):
+    """Records one LLM call on the current span."""
+    span = _current_span.get()
+    if span is None:
+        return
+    span.llm_calls += 1
+    span.prompt_chars += prompt_chars
+    span.input_tokens += input_tokens
+    span.output_tokens += output_tokens
+    span.timings["llm"] = span.timings.get("llm", 0.0) + seconds
+
+def record_timing(kind, seconds):
+    """Adds time spent on an operation kind (e.g. "search") to the current span."""
+    span = _current_span.get()
+    if span is not None:
+        span.timings[kind] = span.timings.get(kind, 0.0) + seconds
+
+def record_call(kind):
+    """Counts one billable upstream call (e.g. "search") on the current span."""
+    span = _current_span.get()
+    if span is not None:
+        span.calls[kind] = span.calls.get(kind, 0) + 1
+
+def record_cache(kind, hit):
+    """Records a cache lookup of the given kind ("llm", "search") on the current span."""
+    span = _current_span.get()
+    if span is None:
+        return
+    counts = span.cache.setdefault(kind, {"hits": 0, "misses": 0})
+    counts["hits" if hit else "misses"] += 1
+
+def record_saved(seconds, tokens):
+    """Records the latency and tokens an LLM cache hit saved on the current span."""
+    span = _current_span.get()
+    if span is None:
+        return
+    span.saved["seconds"] = span.saved.get("seconds", 0.0) + seconds
+    span.saved["tokens"] = span.saved.get("tokens", 0) + tokens
+
+def record_provider(name, queue_seconds=0.0, retry=False):
+    """Records a request to a provider and its rate-limit wait (or, with retry=True, one retry) on the current span."""
+    span = _current_span.get()
+    if span is None:
+        return
+    stats = span.providers.setdefault(name, {"calls": 0, "retries": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0})
+    if retry:
+        stats["retries"] += 1
+        return
+    stats["calls"] += 1
+    stats["queue_seconds"] += queue_seconds
+    stats["max_queue_seconds"] = max(stats["max_queue_seconds"], queue_seconds)
+
+def record_error(error):
+    """Records an error that the node handled on the current span."""
+    span = _current_span.get()
+    if span is not None:
+        span.errors.append(str(error))
+
+# --- 3. Node Wrapper ---
+
+def traced(name, node):
+    """Wraps a graph node so its span is appended to the state's "trace" list."""
+    def finish(span, token, update):
+        _current_span.reset(token)
+        update = dict(update or {})
+        update["trace"] = [span.finish().to_dict()]
+        return update
+
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def traced_node(state):
+            span = Span(name)
+            token = _current_span.set(span)
+            try:
+                update = await node(state)
+            except Exception as e:
+                span.errors.append(str(e))
+                _current_span.reset(token)
+                raise
+            return finish(span, token, update)
+    else:
+        @functools.wraps(node)
+        def traced_node(state):
+            span = Span(name)
+            token = _current_span.set(span)
+            try:
+                update = node(state)
+            except Exception as e:
+                span.errors.append(str(e))
+                _current_span.reset(token)
+                raise
+            return finish(span, token, update)
+
+    return traced_node
+
+# --- 4. Reporting and Export ---
+
+def summarize(trace):
+    """Aggregates spans per node: runs, wall time, LLM/search time, tokens, cache hits, errors."""
+    summary = {}
+    for span in trace:
+        row = summary.setdefault(span["name"], {
+            "node": span["name"], "runs": 0, "seconds": 0.0, "llm_seconds": 0.0, "search_seconds": 0.0,
+            "llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "prompt_chars": 0, "cache_hits": 0, "errors": 0,
+        })
+        row["runs"] += 1
+        row["seconds"] += span["duration"]
+        row["llm_seconds"] += span["timings"].get("llm", 0.0)
+        row["search_seconds"] += span["timings"].get("search", 0.0)
+        row["llm_calls"] += span["llm_calls"]
+        row["input_tokens"] += span["input_tokens"]
+        row["output_tokens"] += span["output_tokens"]
+        row["prompt_chars"] += span["prompt_chars"]
+        row["cache_hits"] += sum(c["hits"] for c in span["cache"].values())
+        row["errors"] += len(span["errors"])
+
+    for row in summary.values():
+        for key in ("seconds", "llm_seconds", "search_seconds"):
+            row[key] = round(row[key], 3)
+    return list(summary.values())
+
+def run_stats(trace):
+    """LLM cache savings and per-provider calls, retries and queueing of one run, from its spans."""
+    cache = {"hits": 0, "saved_seconds": 0.0, "saved_tokens": 0}
+    providers = {}
+    for span in trace:
+        cache["hits"] += span["cache"].get("llm", {}).get("hits", 0)
+        cache["saved_seconds"] += span.get("saved", {}).get("seconds", 0.0)
+        cache["saved_tokens"] += span.get("saved", {}).get("tokens", 0)
+        for name, stats in span.get("providers", {}).items():
+            row = providers.setdefault(name, {"calls": 0, "retries": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0})
+            for key in ("calls", "retries", "queue_seconds"):
+                row[key] += stats[key]
+            row["max_queue_seconds"] = max(row["max_queue_seconds"], stats["max_queue_seconds"])
+
+    for row in providers.values():
+        row["avg_queue_seconds"] = row["queue_seconds"] / row["calls"] if row["calls"] else 0.0
+    return {"llm_cache": cache, "providers": providers}
+
+def to_otlp(trace, trace_id=None, service_name="multi-agent-research-assistant"):
+    """Converts spans into an OTLP/JSON-style resourceSpans payload."""
+    trace_id = trace_id or uuid.uuid4().hex
+
+    def attribute(key, value):
+        kind = "intValue" if isinstance(value, int) else "doubleValue" if isinstance(value, float) else "stringValue"
+        return {"key": key, "value": {kind: value if kind != "stringValue" else str(value)}}
+
+    spans = []
+    for span in trace:
+        start_ns = int(span["start_time"] * 1e9)
+        attributes = [
+            attribute("llm.calls", span["llm_calls"]),
+            attribute("llm.input_tokens", span["input_tokens"]),
+            attribute("llm.output_tokens", span["output_tokens"]),
+            attribute("llm.prompt_chars", span["prompt_chars"]),
+        ]
+        attributes += [attribute(f"time.{kind}_seconds", float(v)) for kind, v in span["timings"].items()]
+        for kind, counts in span["cache"].items():
+            attributes += [attribute(f"cache.{kind}.hits", counts["hits"]), attribute(f"cache.{kind}.misses", counts["misses"])]
+
+        spans.append({
+            "traceId": trace_id,
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(span["duration"] * 1e9)),
+            "attributes": attributes,
+            "events": [{"name": "exception", "attributes": [attribute("exception.message", e)]} for e in span["errors"]],
+            "status": {"code": 2 if span["errors"] else 1},
+        })
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]
+    }
+
+def export_json(trace, path, trace_id=None):
+    """Writes spans to a JSON file in OTLP/JSON form."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_otlp(trace, trace_id), f, indent=2)
@@ -1,7 +1,7 @@
 # visualize_graph.py
 
 import os
-from graph import app
+from graph import get_app
 
 def save_graph_image():
     """
@@ -12,7 +12,7 @@ def save_graph_image():
         os.makedirs("assets", exist_ok=True)
         
         # Get the graph diagram as PNG bytes
-        graph_image = app.get_graph().draw_mermaid_png()
+        graph_image = get_app().get_graph().draw_mermaid_png()
         
         # Define the output path
         output_path = os.path.join("assets", "research_graph.png")
@@ -34,7 +34,7 @@ def save_graph_image():
         print("Trying alternative visualization method...")
         try:
             # Try the mermaid approach without PNG
-            graph_repr = app.get_graph().draw_mermaid()
+            graph_repr = get_app().get_graph().draw_mermaid()
             output_path = os.path.join("assets", "research_graph.mmd")
             
             with open(output_path, "w") as f: